@@ -7,12 +7,1822 @@ A GUI application for batch renaming files by adding parent folder names to file
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
+import sys
+import errno
+import argparse
+import json
+import socket
 import shutil
+import select
+import struct
+import time
+import platform
+import hashlib
+import hmac
+import mmap
+import secrets
+import ctypes
+import ctypes.util
+import contextlib
 from pathlib import Path
+import tempfile
 import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 
-class FileRenamerApp:
+# File metadata preservation levels for copying / Уровни сохранения метаданных при копировании
+METADATA_NONE = 'none'
+METADATA_TIMES = 'times'
+METADATA_FULL = 'full'
+METADATA_LEVELS = {
+    METADATA_NONE: "Без метаданных (быстрее всего)",
+    METADATA_TIMES: "Только даты изменения",
+    METADATA_FULL: "Все метаданные (права, xattr/ACL)",
+}
+
+# Watch mode settings (seconds) / Настройки режима слежения (секунды)
+WATCH_DEBOUNCE = 0.3
+WATCH_MAX_DELAY = 1.0
+WATCH_POLL_INTERVAL = 2.0
+
+# Sharded processing settings / Настройки обработки частями
+SHARD_MAX_FILES = 2000
+SHARD_POLL_INTERVAL = 0.2
+SHARD_PROGRESS_INTERVAL = 0.5
+# Claim lease: workers refresh heartbeat (progress file mtime), stale claims are requeued / Аренда захвата: процессы обновляют пульс (время файла прогресса), устаревшие захваты возвращаются в очередь
+SHARD_HEARTBEAT_INTERVAL = 2.0
+SHARD_LEASE_TIMEOUT = 30.0
+SHARD_SUBDIRS = ('shards', 'claimed', 'done', 'progress')
+
+# Throughput limits / Ограничения скорости
+THROTTLE_CHUNK_SIZE = 1024 * 1024
+# File for changing limits of running job: python file_renamer.py --set-limits ... / Файл для изменения ограничений запущенного задания
+# Per-user, so other users cannot throttle this program / У каждого пользователя свой, чтобы другие пользователи не могли ограничить программу
+LIMITS_CONTROL_FILE = Path.home() / ".file_renamer_limits.json"
+
+# Buffer for reading source file once for several destinations / Буфер чтения файла один раз для нескольких назначений
+FANOUT_CHUNK_SIZE = 1024 * 1024
+
+# Retries of transient I/O errors (NAS, network shares) / Повторы временных ошибок ввода-вывода (NAS, сетевые папки)
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+TRANSIENT_ERRNOS = {
+    code for code in (
+        errno.EIO, errno.EAGAIN, errno.EINTR, errno.EBUSY, errno.ETIMEDOUT,
+        getattr(errno, 'ESTALE', None),
+    ) if code is not None
+}
+# Windows network errors: net name deleted, unexpected network error, semaphore timeout / Сетевые ошибки Windows
+TRANSIENT_WINERRORS = {64, 59, 121}
+
+# Copy verification / Проверка копий
+VERIFY_CHUNK_SIZE = 8 * 1024 * 1024
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
+# Files waiting for check per worker, copying waits when queue is full / Файлов в очереди проверки на поток, копирование ждет при заполненной очереди
+VERIFY_QUEUE_PER_WORKER = 32
+MANIFEST_KEY_FILE = Path.home() / ".file_renamer_manifest.key"
+
+# Metrics for monitoring (Prometheus text format) / Метрики для мониторинга (текстовый формат Prometheus)
+METRICS_HOST = '127.0.0.1'
+METRICS_RATE_WINDOW = 10.0
+METRICS_TEXTFILE_INTERVAL = 5.0
+PAIR_STATES = ('pending', 'running', 'done', 'failed')
+
+# Pair priority classes / Классы приоритета пар
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+PRIORITY_LEVELS = {
+    PRIORITY_HIGH: "Высокий",
+    PRIORITY_NORMAL: "Обычный",
+    PRIORITY_LOW: "Низкий (фоновый ввод-вывод)",
+}
+# Priority -> (Linux I/O class, level): best-effort 0/4, idle / Приоритет -> (класс ввода-вывода Linux, уровень)
+IO_PRIORITY_CLASSES = {
+    PRIORITY_HIGH: (2, 0),
+    PRIORITY_NORMAL: (2, 4),
+    PRIORITY_LOW: (3, 0),
+}
+# ioprio_set syscall numbers by architecture / Номера системного вызова ioprio_set по архитектурам
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    's390x': 282,
+}
+
+
+class _InotifyBackend:
+    """
+    Recursive directory watcher based on Linux inotify.
+    Рекурсивное слежение за папкой на основе inotify (Linux).
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root_path):
+        self.root_path = Path(root_path)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        # Watch descriptor -> relative folder / Дескриптор слежения -> относительная папка
+        self.watches = {}
+        try:
+            self._add_tree(Path())
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, relative_dir):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.root_path / relative_dir), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {self.root_path / relative_dir}")
+        self.watches[wd] = relative_dir
+
+    def _add_tree(self, relative_dir):
+        """
+        Watch folder with subfolders and return files already inside.
+        Следить за папкой с подпапками и вернуть уже имеющиеся в ней файлы.
+        """
+        files = []
+        for current, dirs, names in os.walk(self.root_path / relative_dir):
+            current_rel = Path(current).relative_to(self.root_path)
+            self._add_watch(current_rel)
+            files.extend(current_rel / name for name in names)
+        return files
+
+    def read_events(self, timeout):
+        """
+        Wait for events and return changed relative paths.
+        Ждать события и вернуть относительные пути изменений.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+            if mask & self.IN_Q_OVERFLOW:
+                # Events lost, resync whole tree / События потеряны, синхронизируем все дерево
+                changed.extend(self._add_tree(Path()))
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            relative_dir = self.watches.get(wd)
+            if relative_dir is None or not name:
+                continue
+            relative_path = relative_dir / name
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                # Files may appear before watch is added / Файлы могут появиться раньше установки слежения
+                try:
+                    changed.extend(self._add_tree(relative_path))
+                except OSError:
+                    changed.append(relative_path)
+            elif mask & self.IN_CREATE:
+                # File is mirrored on close after writing / Файл копируется после закрытия на запись
+                continue
+            else:
+                changed.append(relative_path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _PollingBackend:
+    """
+    Directory watcher fallback that compares tree snapshots.
+    Запасной вариант слежения через сравнение снимков дерева.
+    """
+    def __init__(self, root_path, interval=WATCH_POLL_INTERVAL):
+        self.root_path = Path(root_path)
+        self.interval = interval
+        self.snapshot, self.folders = self._scan()
+        self.next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        folders = set()
+        for current, dirs, names in os.walk(self.root_path):
+            current_rel = Path(current).relative_to(self.root_path)
+            folders.add(current_rel)
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(current, name))
+                except OSError:
+                    continue
+                snapshot[current_rel / name] = (st.st_size, st.st_mtime_ns)
+        return snapshot, folders
+
+    def read_events(self, timeout):
+        """
+        Wait until next scan and return changed relative paths.
+        Ждать следующего сканирования и вернуть относительные пути изменений.
+        """
+        delay = self.next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+        self.next_scan = time.monotonic() + self.interval
+        snapshot, folders = self._scan()
+        changed = [path for path, state in snapshot.items() if self.snapshot.get(path) != state]
+        changed.extend(path for path in self.snapshot if path not in snapshot)
+        # Removed folders are reported to remove them in destination / Удаленные папки сообщаются для удаления в папке назначения
+        changed.extend(path for path in self.folders if path not in folders)
+        self.snapshot, self.folders = snapshot, folders
+        return changed
+
+    def close(self):
+        pass
+
+
+class FolderWatcher(threading.Thread):
+    """
+    Background thread that watches source folder and reports coalesced changes.
+    Problems (inotify fallback, errors of on_changes) are reported to on_error(message).
+    Фоновый поток, следящий за исходной папкой и сообщающий объединенные изменения.
+    Проблемы (переход на опрос, ошибки on_changes) сообщаются в on_error(сообщение).
+    """
+    def __init__(self, source_path, on_changes, on_error=None, debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY):
+        super().__init__(daemon=True)
+        self.source_path = Path(source_path)
+        self.on_changes = on_changes
+        self.on_error = on_error
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.stop_event = threading.Event()
+        # Created in run(), so scanning large trees does not block caller / Создается в run(), чтобы сканирование больших деревьев не блокировало вызывающий поток
+        self.backend = None
+
+    def _create_backend(self):
+        if sys.platform.startswith('linux'):
+            try:
+                return _InotifyBackend(self.source_path)
+            except (OSError, AttributeError) as e:
+                # E.g. watch limit reached / Например, достигнут лимит слежений
+                self._report(f"inotify недоступен для {self.source_path}, используется опрос: {e}")
+        return _PollingBackend(self.source_path)
+
+    def _report(self, message):
+        if self.on_error is not None and not self.stop_event.is_set():
+            self.on_error(message)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        pending = set()
+        first_event = last_event = 0.0
+        if self.backend is None:
+            self.backend = self._create_backend()
+        try:
+            while not self.stop_event.is_set():
+                timeout = self.debounce if pending else 1.0
+                changed = self.backend.read_events(timeout)
+                now = time.monotonic()
+                if changed:
+                    if not pending:
+                        first_event = now
+                    pending.update(changed)
+                    last_event = now
+                if self.stop_event.is_set():
+                    break
+                if pending and (now - last_event >= self.debounce or now - first_event >= self.max_delay):
+                    batch = sorted(pending)
+                    pending.clear()
+                    try:
+                        self.on_changes(batch)
+                    except Exception as e:
+                        self._report(f"Ошибка синхронизации {self.source_path}: {e}")
+        finally:
+            self.backend.close()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: rate per second, rate 0 means no limit.
+    Rate can be changed while copying is in progress.
+    Потокобезопасное ведро токенов: скорость в секунду, 0 - без ограничения.
+    Скорость можно менять во время копирования.
+    """
+    def __init__(self, rate=0.0):
+        self._lock = threading.Lock()
+        self.rate = max(0.0, rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            # One second of burst at most / Не более одной секунды запаса
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = max(0.0, rate)
+            self.tokens = min(self.tokens, self.rate)
+
+    def consume(self, amount):
+        """
+        Take tokens, sleeping while bucket is in debt.
+        Взять токены, ожидая, пока ведро в долгу.
+        """
+        with self._lock:
+            if self.rate <= 0:
+                return
+            self._refill()
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class IOThrottle:
+    """
+    Throughput limits shared by all copy workers (MB/s and files/s).
+    Ограничения скорости, общие для всех потоков копирования (МБ/с и файлов/с).
+    """
+    def __init__(self, mb_per_sec=0.0, files_per_sec=0.0):
+        self.bytes_bucket = TokenBucket()
+        self.files_bucket = TokenBucket()
+        self.set_limits(mb_per_sec, files_per_sec)
+
+    def set_limits(self, mb_per_sec=0.0, files_per_sec=0.0):
+        self.mb_per_sec = max(0.0, mb_per_sec or 0.0)
+        self.files_per_sec = max(0.0, files_per_sec or 0.0)
+        self.bytes_bucket.set_rate(self.mb_per_sec * 1024 * 1024)
+        self.files_bucket.set_rate(self.files_per_sec)
+
+    @property
+    def limits(self):
+        return {'mb_per_sec': self.mb_per_sec, 'files_per_sec': self.files_per_sec}
+
+    def copyfile(self, src, dst):
+        """
+        Copy file contents within limits (shutil.copyfile when bytes are not limited).
+        Копировать содержимое файла с ограничениями (shutil.copyfile, если байты не ограничены).
+        """
+        self.files_bucket.consume(1)
+        if self.mb_per_sec <= 0:
+            return shutil.copyfile(src, dst)
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            while True:
+                chunk = fsrc.read(THROTTLE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.bytes_bucket.consume(len(chunk))
+                fdst.write(chunk)
+        return dst
+
+
+def copyfile_fanout(src, destinations, throttle=None):
+    """
+    Copy file contents to several destinations reading source only once.
+    Throttle is charged for every destination, like separate copies.
+    Destination that fails to open or write is dropped and the others are still written;
+    returns {destination: error} of dropped destinations, source errors are raised.
+    Копировать содержимое файла в несколько назначений, читая источник только один раз.
+    Ограничения учитываются для каждого назначения, как при отдельных копиях.
+    Назначение, которое не удалось открыть или записать, исключается, остальные записываются;
+    возвращает {назначение: ошибка} исключенных назначений, ошибки источника выбрасываются.
+    """
+    if throttle is not None:
+        throttle.files_bucket.consume(len(destinations))
+    errors = {}
+    buffer = bytearray(FANOUT_CHUNK_SIZE)
+    view = memoryview(buffer)
+    outputs = {}
+    with open(src, 'rb') as fsrc:
+        try:
+            for dst in destinations:
+                try:
+                    outputs[dst] = open(dst, 'wb')
+                except OSError as e:
+                    errors[dst] = e
+            while outputs:
+                size = fsrc.readinto(buffer)
+                if not size:
+                    break
+                if throttle is not None and throttle.mb_per_sec > 0:
+                    throttle.bytes_bucket.consume(size * len(outputs))
+                for dst, fdst in list(outputs.items()):
+                    try:
+                        fdst.write(view[:size])
+                    except OSError as e:
+                        errors[dst] = e
+                        del outputs[dst]
+                        with contextlib.suppress(OSError):
+                            fdst.close()
+        finally:
+            for dst, fdst in outputs.items():
+                try:
+                    fdst.close()
+                except OSError as e:
+                    errors.setdefault(dst, e)
+    return errors
+
+
+def _path_within(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def group_overlapping_pairs(pairs, order=None):
+    """
+    Group pair indices whose sources are identical or nested, first index has outermost source.
+    Groups whose destination lies inside group source are split, so source is not changed while read.
+    Сгруппировать индексы пар с одинаковыми или вложенными источниками, первый индекс - с внешним источником.
+    Группы, у которых назначение лежит внутри источника, разделяются, чтобы источник не менялся во время чтения.
+    """
+    order = list(range(len(pairs)) if order is None else order)
+    position = {index: n for n, index in enumerate(order)}
+    real = {index: os.path.normcase(os.path.realpath(pairs[index]['source'])) for index in order}
+    groups = []
+    # Outer sources first, list order for identical sources / Сначала внешние источники, одинаковые - по порядку списка
+    for index in sorted(order, key=lambda index: len(real[index])):
+        for group in groups:
+            if _path_within(real[index], real[group[0]]):
+                group.append(index)
+                break
+        else:
+            groups.append([index])
+    result = []
+    for group in groups:
+        destinations = [os.path.normcase(os.path.realpath(pairs[index]['destination'])) for index in group]
+        if len(group) > 1 and any(_path_within(dest, real[group[0]]) for dest in destinations):
+            result.extend([index] for index in group)
+        else:
+            result.append(group[:1] + sorted(group[1:], key=position.get))
+    result.sort(key=lambda group: min(position[index] for index in group))
+    return result
+
+
+def count_tree_files(root_path, subfolders=()):
+    """
+    Count files of root_path and of its subfolders (relative paths) in one walk without stat per file.
+    Returns list: count of root_path, then counts of subfolders.
+    Подсчитать файлы root_path и его подпапок (относительные пути) за один обход без stat для каждого файла.
+    Возвращает список: количество в root_path, затем количества в подпапках.
+    """
+    prefixes = [() if relative == os.curdir else tuple(relative.split(os.sep)) for relative in subfolders]
+    totals = [0] * (len(prefixes) + 1)
+    stack = [((), os.fspath(root_path))]
+    while stack:
+        parts, dir_path = stack.pop()
+        count = 0
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        stack.append((parts + (entry.name,), entry.path))
+                    else:
+                        count += 1
+        except OSError:
+            # Count is only for progress, errors are reported when pair is scanned / Подсчет нужен только для прогресса, ошибки сообщаются при сканировании пары
+            continue
+        totals[0] += count
+        for n, prefix in enumerate(prefixes, 1):
+            if parts[:len(prefix)] == prefix:
+                totals[n] += count
+    return totals
+
+
+def is_transient_error(error):
+    """
+    Check whether OS error is worth retrying.
+    Проверить, стоит ли повторять операцию после ошибки ОС.
+    """
+    return error.errno in TRANSIENT_ERRNOS or getattr(error, 'winerror', None) in TRANSIENT_WINERRORS
+
+
+def retry_io(func, *args, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY):
+    """
+    Call func, retrying transient OS errors with exponential backoff.
+    Вызвать func, повторяя при временных ошибках ОС с экспоненциальной задержкой.
+    """
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except OSError as e:
+            if attempt == attempts - 1 or not is_transient_error(e):
+                raise
+            time.sleep(base_delay * 2 ** attempt)
+
+
+def failure_record(stage, relative_path, error):
+    """
+    Structured failure entry; relative_path None means whole pair failed.
+    Структурированная запись об ошибке; relative_path None означает ошибку всей пары.
+    """
+    return {
+        'stage': stage,
+        'path': None if relative_path is None else os.fspath(relative_path),
+        'error': str(error),
+        'errno': getattr(error, 'errno', None),
+    }
+
+
+def failures_path(destination):
+    """
+    Failure list file of pair (next to destination folder, so it survives its recreation).
+    Файл списка ошибок пары (рядом с папкой назначения, чтобы переживать ее пересоздание).
+    """
+    destination = Path(destination)
+    return destination.parent / f"{destination.name}.failures.json"
+
+
+def _retry_rmtree_error(func, path, error):
+    """
+    shutil.rmtree error handler: retry transient removal errors, re-raise others.
+    error is exception (onexc) or exc_info tuple (onerror before Python 3.12).
+    Обработчик ошибок shutil.rmtree: повторить временные ошибки удаления, остальные выбросить.
+    error - исключение (onexc) или кортеж exc_info (onerror до Python 3.12).
+    """
+    if isinstance(error, tuple):
+        error = error[1]
+    if func in (os.unlink, os.remove, os.rmdir) and isinstance(error, OSError) and is_transient_error(error):
+        retry_io(func, path)
+    else:
+        raise error
+
+
+def rmtree_with_retry(path):
+    """
+    Remove folder tree retrying transient errors.
+    Удалить дерево папок с повтором временных ошибок.
+    """
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(path, onexc=_retry_rmtree_error)
+    else:
+        shutil.rmtree(path, onerror=_retry_rmtree_error)
+
+
+def read_limits_file(path, current=None):
+    """
+    Read limits JSON ({'mb_per_sec': ..., 'files_per_sec': ...}), None if missing or broken.
+    Limit missing in file is taken from current limits dict (0 without it).
+    Прочитать JSON ограничений, None если файла нет или он поврежден.
+    Ограничение, которого нет в файле, берется из словаря текущих ограничений current (0 без него).
+    """
+    current = current or {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return (float(data.get('mb_per_sec', current.get('mb_per_sec', 0))),
+                float(data.get('files_per_sec', current.get('files_per_sec', 0))))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return None
+
+
+def set_io_priority(priority):
+    """
+    Set I/O priority of calling thread (Linux ioprio_set, like ionice). Returns True on success.
+    Установить приоритет ввода-вывода текущего потока (ioprio_set в Linux, как ionice). Возвращает True при успехе.
+    """
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if not sys.platform.startswith('linux') or syscall_number is None:
+        return False
+    io_class, level = IO_PRIORITY_CLASSES.get(priority, IO_PRIORITY_CLASSES[PRIORITY_NORMAL])
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        # IOPRIO_WHO_PROCESS with id 0 means calling thread / IOPRIO_WHO_PROCESS с id 0 означает текущий поток
+        return libc.syscall(syscall_number, 1, 0, (io_class << 13) | level) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def hash_file(path, chunk_size=VERIFY_CHUNK_SIZE):
+    """
+    SHA-256 of file read through memory map in large chunks.
+    SHA-256 файла, читаемого через отображение в память большими блоками.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            # Empty file cannot be mapped / Пустой файл нельзя отобразить в память
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                # hashlib releases GIL for large blocks, so threads hash in parallel / hashlib отпускает GIL на больших блоках, поэтому потоки считают параллельно
+                for offset in range(0, size, chunk_size):
+                    digest.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def verify_copy(source_file, target_file, relative_path, target_relative_path):
+    """
+    Compare copied file with source: sizes first, then content hashes.
+    Сравнить скопированный файл с источником: сначала размеры, затем хеши содержимого.
+    """
+    record = {'path': os.fspath(relative_path), 'target': os.fspath(target_relative_path),
+              'size': None, 'sha256': None, 'ok': False, 'error': None}
+    try:
+        source_size = os.stat(source_file).st_size
+        target_size = os.stat(target_file).st_size
+        record['size'] = source_size
+        if source_size != target_size:
+            record['error'] = f"size mismatch: {source_size} != {target_size}"
+            return record
+        source_hash = hash_file(source_file)
+        record['sha256'] = source_hash
+        if hash_file(target_file) != source_hash:
+            record['error'] = "sha256 mismatch"
+            return record
+        record['ok'] = True
+    except OSError as e:
+        record['error'] = str(e)
+    return record
+
+
+def manifest_signing_key():
+    """
+    HMAC key for checksum manifests: FILE_RENAMER_MANIFEST_KEY or key file created on first use.
+    Ключ HMAC для манифестов контрольных сумм: FILE_RENAMER_MANIFEST_KEY или файл ключа, создаваемый при первом использовании.
+    """
+    env_key = os.environ.get('FILE_RENAMER_MANIFEST_KEY')
+    if env_key:
+        return env_key.encode('utf-8')
+    try:
+        return MANIFEST_KEY_FILE.read_bytes()
+    except FileNotFoundError:
+        key = secrets.token_bytes(32)
+        fd = os.open(MANIFEST_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        return key
+
+
+def _manifest_line(data):
+    return (json.dumps(data, sort_keys=True, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class ChecksumManifestWriter:
+    """
+    Checksum manifest written as JSON lines while checks finish: header, one line per file,
+    trailer with totals and HMAC-SHA256 of all previous lines. Only mismatches are kept in memory.
+    Манифест контрольных сумм, записываемый JSON-строками по мере проверок: заголовок, строка на файл,
+    итоговая строка с количествами и HMAC-SHA256 всех предыдущих строк. В памяти хранятся только несовпадения.
+    """
+    def __init__(self, path, header):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self.lock = threading.Lock()
+        self.mac = hmac.new(manifest_signing_key(), digestmod=hashlib.sha256)
+        self.verified = 0
+        self.mismatched = []
+        self.error = None
+        self.file = open(self.tmp_path, 'wb')
+        self._write(_manifest_line(header))
+
+    def _write(self, line):
+        self.mac.update(line)
+        self.file.write(line)
+
+    def add(self, record):
+        with self.lock:
+            if record['ok']:
+                self.verified += 1
+            else:
+                self.mismatched.append(record)
+            if self.error is None:
+                try:
+                    self._write(_manifest_line(record))
+                except OSError as e:
+                    self.error = e
+
+    def close(self):
+        """
+        Write signed trailer and move manifest into place (removed when nothing was checked).
+        Записать подписанную итоговую строку и переместить манифест на место (удаляется, если ничего не проверялось).
+        """
+        try:
+            if self.error is not None:
+                raise self.error
+            if not self.verified and not self.mismatched:
+                return
+            trailer = {'verified': self.verified, 'mismatched': len(self.mismatched)}
+            self.mac.update(_manifest_line(trailer))
+            trailer['signature'] = self.mac.hexdigest()
+            self.file.write(_manifest_line(trailer))
+            self.file.close()
+            os.replace(self.tmp_path, self.path)
+        finally:
+            self.file.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def check_manifest_signature(path):
+    """
+    Check that manifest was not changed after signing, returns trailer (totals) or None.
+    Проверить, что манифест не изменялся после подписи, возвращает итоговую строку (количества) или None.
+    """
+    mac = hmac.new(manifest_signing_key(), digestmod=hashlib.sha256)
+    previous = None
+    with open(path, 'rb') as f:
+        # All lines except trailer are signed as written / Все строки, кроме итоговой, подписываются в записанном виде
+        for line in f:
+            if previous is not None:
+                mac.update(previous)
+            previous = line
+    try:
+        trailer = json.loads(previous) if previous is not None else None
+    except ValueError:
+        return None
+    if not isinstance(trailer, dict) or 'signature' not in trailer:
+        return None
+    signature = trailer.pop('signature')
+    mac.update(_manifest_line(trailer))
+    if not hmac.compare_digest(mac.hexdigest(), str(signature)):
+        return None
+    return trailer
+
+
+def checksum_manifest_path(destination):
+    """
+    Checksum manifest file of pair (next to destination folder).
+    Файл манифеста контрольных сумм пары (рядом с папкой назначения).
+    """
+    destination = Path(destination)
+    return destination.parent / f"{destination.name}.sha256.jsonl"
+
+
+class CopyVerifier:
+    """
+    Background verification of copied files in thread pool.
+    Checks run while other files are still being copied; the queue is bounded,
+    so copying waits for hashing, and results are streamed to manifest of pair.
+    Фоновая проверка скопированных файлов в пуле потоков.
+    Проверки идут, пока другие файлы еще копируются; очередь ограничена,
+    поэтому копирование ждет хеширования, а результаты сразу пишутся в манифест пары.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or VERIFY_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(self.workers * VERIFY_QUEUE_PER_WORKER)
+        # Pair key -> manifest writer / Ключ пары -> запись манифеста
+        self.manifests = {}
+        # Counters for queue depth and waiting for pair / Счетчики для глубины очереди и ожидания пары
+        self.lock = threading.Condition()
+        self.submitted = 0
+        self.completed = 0
+        self.pair_pending = {}
+        # Files being hashed, bounded by queue size / Файлы, которые хешируются, ограничено размером очереди
+        self.in_flight = set()
+
+    def open_manifest(self, key, path, header):
+        """
+        Start manifest of pair (once per key).
+        Начать манифест пары (один раз для ключа).
+        """
+        if key not in self.manifests:
+            self.manifests[key] = ChecksumManifestWriter(path, header)
+
+    def submit(self, key, source_file, target_file, relative_path, target_relative_path):
+        self.slots.acquire()
+        target_file = os.fspath(target_file)
+        with self.lock:
+            self.submitted += 1
+            self.pair_pending[key] = self.pair_pending.get(key, 0) + 1
+            self.in_flight.add(target_file)
+        future = self.executor.submit(verify_copy, source_file, target_file, relative_path, target_relative_path)
+        future.add_done_callback(lambda future: self._on_done(key, future, target_file, relative_path, target_relative_path))
+
+    def wait_released(self, target_file):
+        """
+        Wait until check of file is done, so file can be renamed.
+        Дождаться окончания проверки файла, чтобы его можно было переименовать.
+        """
+        target_file = os.fspath(target_file)
+        with self.lock:
+            self.lock.wait_for(lambda: target_file not in self.in_flight)
+
+    def _on_done(self, key, future, target_file, relative_path, target_relative_path):
+        try:
+            record = future.result()
+        except Exception as e:
+            record = {'path': os.fspath(relative_path), 'target': os.fspath(target_relative_path),
+                      'size': None, 'sha256': None, 'ok': False, 'error': str(e)}
+        try:
+            self.manifests[key].add(record)
+        finally:
+            self.slots.release()
+            with self.lock:
+                self.completed += 1
+                self.pair_pending[key] -= 1
+                self.in_flight.discard(target_file)
+                self.lock.notify_all()
+
+    @property
+    def queued(self):
+        return self.submitted - self.completed
+
+    def finish(self, key):
+        """
+        Wait for checks of pair, sign its manifest and return (verified count, mismatched records).
+        Returns None when pair had no checks.
+        Дождаться проверок пары, подписать ее манифест и вернуть (число проверенных, записи несовпадений).
+        Возвращает None, если у пары не было проверок.
+        """
+        with self.lock:
+            self.lock.wait_for(lambda: not self.pair_pending.get(key))
+            self.pair_pending.pop(key, None)
+        manifest = self.manifests.pop(key, None)
+        if manifest is None:
+            return None
+        manifest.close()
+        return manifest.verified, manifest.mismatched
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for manifest in self.manifests.values():
+            manifest.file.close()
+            manifest.tmp_path.unlink(missing_ok=True)
+        self.manifests.clear()
+
+
+def _metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render_metrics(families):
+    """
+    Render (name, type, help, [(labels, value)]) metric families in Prometheus text format.
+    Сформировать семейства метрик (имя, тип, описание, [(метки, значение)]) в текстовом формате Prometheus.
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{_metric_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """
+    Serve metrics of collector on local HTTP port (/metrics) and/or write them to textfile.
+    collect() returns metric families for render_metrics and is called on every scrape.
+    Отдавать метрики сборщика на локальном HTTP-порту (/metrics) и/или записывать их в текстовый файл.
+    collect() возвращает семейства метрик для render_metrics и вызывается при каждом запросе.
+    """
+    def __init__(self, collect, port=0, textfile=None, host=METRICS_HOST, interval=METRICS_TEXTFILE_INTERVAL):
+        self.collect = collect
+        self.port = port
+        self.textfile = Path(textfile) if textfile else None
+        self.interval = interval
+        self.server = None
+        self.stopped = threading.Event()
+        if port:
+            self.server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+            self.server.daemon_threads = True
+            self.server.exporter = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.textfile is not None:
+            threading.Thread(target=self._textfile_loop, daemon=True).start()
+
+    def render(self):
+        return render_metrics(self.collect())
+
+    def write_textfile(self):
+        # Atomic replace, so collectors never read partial file / Атомарная замена, чтобы сборщики не читали частичный файл
+        tmp_path = self.textfile.with_name(f".{self.textfile.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_text(self.render(), encoding='utf-8')
+            os.replace(tmp_path, self.textfile)
+        except OSError as e:
+            print(f"Не удалось записать файл метрик {self.textfile}: {e}")
+
+    def _textfile_loop(self):
+        self.write_textfile()
+        while not self.stopped.wait(self.interval):
+            self.write_textfile()
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.textfile is not None:
+            self.write_textfile()
+
+
+class RenamePlan:
+    """
+    Compact in-memory plan of folder tree.
+    Folders are stored once (parent index + name), files are kept in array columns
+    (folder id, name, suffix id, size, mtime) and full paths are built only on demand.
+    Компактный план дерева папок в памяти.
+    Папки хранятся один раз (индекс родителя + имя), файлы хранятся в колонках-массивах
+    (id папки, имя, id расширения, размер, время изменения), полные пути строятся только по запросу.
+    """
+    ROOT = 0
+
+    def __init__(self):
+        # Folders / Папки
+        self.dir_parent = array('i', [-1])
+        self.dir_names = ['']
+        # Files: stems are packed into one buffer / Файлы: имена упакованы в один буфер
+        self.file_dir = array('i')
+        self.stem_buffer = bytearray()
+        self.stem_offsets = array('Q', [0])
+        self.file_suffix = array('I')
+        self.file_size = array('q')
+        self.file_mtime = array('q')
+        # Interned suffixes / Интернированные расширения
+        self.suffixes = []
+        self._suffix_ids = {}
+
+    @classmethod
+    def scan(cls, root_path, failures=None):
+        """
+        Build plan by scanning folder tree.
+        Unreadable entries are added to failures list (stage 'scan') and skipped; without it OSError is raised.
+        Errors of root folder are always raised.
+        Построить план сканированием дерева папок.
+        Нечитаемые элементы добавляются в список failures (этап 'scan') и пропускаются; без него выбрасывается OSError.
+        Ошибки корневой папки выбрасываются всегда.
+        """
+        plan = cls()
+        root_path = os.fspath(root_path)
+        stack = [(cls.ROOT, root_path)]
+        while stack:
+            dir_id, dir_path = stack.pop()
+            try:
+                entries = retry_io(_list_dir, dir_path)
+            except OSError as e:
+                if failures is None or dir_id == cls.ROOT:
+                    raise
+                failures.append(failure_record('scan', os.path.relpath(dir_path, root_path), e))
+                continue
+            subdirs = []
+            for entry in entries:
+                try:
+                    # Symlinks are followed like in shutil.copytree / Символические ссылки разворачиваются как в shutil.copytree
+                    if entry.is_dir():
+                        subdirs.append(entry)
+                        continue
+                    st = retry_io(entry.stat)
+                except OSError as e:
+                    # E.g. dangling symlink / Например, битая символическая ссылка
+                    if failures is None:
+                        raise
+                    failures.append(failure_record('scan', os.path.relpath(entry.path, root_path), e))
+                    continue
+                plan.add_file(dir_id, entry.name, st.st_size, st.st_mtime_ns)
+            for entry in subdirs:
+                stack.append((plan.add_dir(dir_id, entry.name), entry.path))
+        return plan
+
+    @classmethod
+    def from_folders(cls, folders):
+        """
+        Build plan from [folder parts, file names, file sizes] list (shard format).
+        Построить план из списка [части пути папки, имена файлов, размеры файлов] (формат части задания).
+        """
+        plan = cls()
+        dir_ids = {(): cls.ROOT}
+        for parts, names, sizes in folders:
+            parts = tuple(parts)
+            for depth in range(1, len(parts) + 1):
+                if parts[:depth] not in dir_ids:
+                    dir_ids[parts[:depth]] = plan.add_dir(dir_ids[parts[:depth - 1]], parts[depth - 1])
+            for name, size in zip(names, sizes):
+                plan.add_file(dir_ids[parts], name, size)
+        return plan
+
+    def add_dir(self, parent_id, name):
+        self.dir_parent.append(parent_id)
+        self.dir_names.append(name)
+        return len(self.dir_names) - 1
+
+    def add_file(self, dir_id, name, size=0, mtime_ns=0):
+        # Same split as Path.stem/Path.suffix / Такое же деление, как у Path.stem/Path.suffix
+        i = name.rfind('.')
+        if 0 < i < len(name) - 1:
+            stem, suffix = name[:i], name[i:]
+        else:
+            stem, suffix = name, ''
+        suffix_id = self._suffix_ids.get(suffix)
+        if suffix_id is None:
+            suffix_id = self._suffix_ids[suffix] = len(self.suffixes)
+            self.suffixes.append(suffix)
+        self.file_dir.append(dir_id)
+        self.stem_buffer += os.fsencode(stem)
+        self.stem_offsets.append(len(self.stem_buffer))
+        self.file_suffix.append(suffix_id)
+        self.file_size.append(size)
+        self.file_mtime.append(mtime_ns)
+
+    def __len__(self):
+        return len(self.file_dir)
+
+    @property
+    def dir_count(self):
+        return len(self.dir_names)
+
+    def stem(self, index):
+        return os.fsdecode(bytes(self.stem_buffer[self.stem_offsets[index]:self.stem_offsets[index + 1]]))
+
+    def suffix(self, index):
+        return self.suffixes[self.file_suffix[index]]
+
+    def file_name(self, index):
+        return self.stem(index) + self.suffix(index)
+
+    def dir_parts(self, dir_id):
+        """
+        Folder names from root to folder.
+        Названия папок от корня до папки.
+        """
+        parts = []
+        while dir_id > self.ROOT:
+            parts.append(self.dir_names[dir_id])
+            dir_id = self.dir_parent[dir_id]
+        parts.reverse()
+        return parts
+
+    def dir_relative_path(self, dir_id):
+        parts = self.dir_parts(dir_id)
+        return os.path.join(*parts) if parts else os.curdir
+
+    def dir_paths(self, root_path):
+        """
+        Full paths of all folders under root_path (index = folder id).
+        Полные пути всех папок относительно root_path (индекс = id папки).
+        """
+        paths = [os.fspath(root_path)]
+        # Parent always has smaller id / У родителя всегда меньший id
+        for dir_id in range(1, self.dir_count):
+            paths.append(os.path.join(paths[self.dir_parent[dir_id]], self.dir_names[dir_id]))
+        return paths
+
+    def folder_ranges(self):
+        """
+        Yield (folder id, first file, end file) for runs of files in same folder.
+        Выдает (id папки, первый файл, конец) для подряд идущих файлов одной папки.
+        """
+        start = 0
+        for index in range(1, len(self) + 1):
+            if index == len(self) or self.file_dir[index] != self.file_dir[start]:
+                yield self.file_dir[start], start, index
+                start = index
+
+    def shards(self, max_files=SHARD_MAX_FILES):
+        """
+        Split plan by folders into shards of about max_files files.
+        Folder is never split, so name conflicts stay inside one shard.
+        Разделить план по папкам на части примерно по max_files файлов.
+        Папка никогда не делится, поэтому конфликты имен остаются внутри одной части.
+        """
+        folders = []
+        count = 0
+        for dir_id, start, end in self.folder_ranges():
+            folders.append([
+                self.dir_parts(dir_id),
+                [self.file_name(index) for index in range(start, end)],
+                list(self.file_size[start:end]),
+            ])
+            count += end - start
+            if count >= max_files:
+                yield folders
+                folders = []
+                count = 0
+        if folders:
+            yield folders
+
+    def find_dir(self, parts):
+        """
+        Folder id by folder names from root (None if folder is not in plan).
+        Id папки по названиям папок от корня (None, если папки нет в плане).
+        """
+        dir_id = self.ROOT
+        for name in parts:
+            # Children always have larger id / У дочерних папок всегда больший id
+            for child in range(dir_id + 1, self.dir_count):
+                if self.dir_parent[child] == dir_id and self.dir_names[child] == name:
+                    dir_id = child
+                    break
+            else:
+                return None
+        return dir_id
+
+    def subtree_mask(self, dir_id):
+        """
+        Byte mask of folders inside folder subtree (index = folder id).
+        Байтовая маска папок поддерева папки (индекс = id папки).
+        """
+        mask = bytearray(self.dir_count)
+        mask[dir_id] = 1
+        for child in range(dir_id + 1, self.dir_count):
+            if mask[self.dir_parent[child]]:
+                mask[child] = 1
+        return mask
+
+    def subplan(self, dir_id):
+        """
+        Plan of folder subtree and indices of its files in this plan (None for root).
+        План поддерева папки и индексы его файлов в этом плане (None для корня).
+        """
+        if dir_id == self.ROOT:
+            return self, None
+        mask = self.subtree_mask(dir_id)
+        plan = RenamePlan()
+        dir_map = {dir_id: self.ROOT}
+        for child in range(dir_id + 1, self.dir_count):
+            if mask[child]:
+                dir_map[child] = plan.add_dir(dir_map[self.dir_parent[child]], self.dir_names[child])
+        indices = array('Q')
+        for folder_id, start, end in self.folder_ranges():
+            new_dir = dir_map.get(folder_id)
+            if new_dir is None:
+                continue
+            for index in range(start, end):
+                plan.add_file(new_dir, self.file_name(index), self.file_size[index], self.file_mtime[index])
+                indices.append(index)
+        return plan, indices
+
+    def relative_path(self, index):
+        return os.path.join(*self.dir_parts(self.file_dir[index]), self.file_name(index))
+
+    def file_path(self, index, root_path):
+        return os.path.join(os.fspath(root_path), self.relative_path(index))
+
+
+def _list_dir(path):
+    with os.scandir(path) as entries:
+        return list(entries)
+
+
+def _write_json_atomic(path, data):
+    """
+    Write JSON file atomically (through temporary file).
+    Атомарно записать JSON-файл (через временный файл).
+    """
+    path = Path(path)
+    # Thread id too: worker heartbeat may rewrite progress file concurrently / Также id потока: пульс рабочего процесса может одновременно перезаписывать файл прогресса
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _claim_next_shard(manifest_dir, worker_id, prefix=''):
+    """
+    Claim pending shard by renaming it (no locks needed, rename is atomic).
+    Returns (shard id, claimed file) or None.
+    Захватить ожидающую часть переименованием файла (блокировки не нужны, переименование атомарно).
+    Возвращает (id части, захваченный файл) или None.
+    """
+    manifest_dir = Path(manifest_dir)
+    for name in sorted(os.listdir(manifest_dir / 'shards')):
+        if not name.endswith('.json') or not name.startswith(prefix):
+            continue
+        shard_id = name[:-len('.json')]
+        claimed_path = manifest_dir / 'claimed' / f"{shard_id}@{worker_id}.json"
+        try:
+            os.rename(manifest_dir / 'shards' / name, claimed_path)
+        except FileNotFoundError:
+            # Claimed by another worker / Захвачена другим процессом
+            continue
+        return shard_id, claimed_path
+    return None
+
+
+def _live_workers(manifest_dir):
+    """
+    Ids of workers whose heartbeat (progress file mtime) is not older than lease timeout.
+    Id процессов, чей пульс (время изменения файла прогресса) не старше срока аренды.
+    """
+    now = time.time()
+    live = set()
+    with os.scandir(Path(manifest_dir) / 'progress') as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if now - entry.stat().st_mtime <= SHARD_LEASE_TIMEOUT:
+                    live.add(entry.name[:-len('.json')])
+            except FileNotFoundError:
+                continue
+    return live
+
+
+def _process_claimed_shard(engine, manifest_dir, shard_id, claimed_path, on_file_processed=None):
+    """
+    Process claimed shard and return its result.
+    Обработать захваченную часть и вернуть результат.
+    """
+    with open(claimed_path, encoding='utf-8') as f:
+        shard = json.load(f)
+    try:
+        return engine.process_shard(shard, on_file_processed)
+    except Exception as e:
+        # Shard folders are unknown to failure list, so whole pair is redone on retry / Папки части не попадают в список ошибок, поэтому при повторе обрабатывается вся пара
+        return {'renamed': 0, 'failures': [failure_record('shard', None, e)]}
+
+
+def _finish_shard(manifest_dir, shard_id, claimed_path, result):
+    """
+    Record shard result in manifest and release claim.
+    Записать результат части в манифест и освободить захват.
+    """
+    _write_json_atomic(Path(manifest_dir) / 'done' / f"{shard_id}.json", result)
+    try:
+        os.remove(claimed_path)
+    except FileNotFoundError:
+        # Lease expired and claim was requeued / Аренда истекла, захват возвращен в очередь
+        pass
+
+
+def _read_job_id(path):
+    """
+    Job id stored in marker file (None if there is no valid marker).
+    Id задания из файла-маркера (None, если корректного маркера нет).
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['id']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _wait_for_shard_job(manifest_dir):
+    """
+    Wait until coordinator starts job that is not finished yet and return its id.
+    Дождаться, пока координатор запустит еще не завершенное задание, и вернуть его id.
+    """
+    while True:
+        job_id = _read_job_id(manifest_dir / 'job.json')
+        if job_id is not None and job_id != _read_job_id(manifest_dir / 'FINISHED'):
+            return job_id
+        time.sleep(SHARD_POLL_INTERVAL)
+
+
+def run_shard_worker(manifest_dir, worker_id=None, job_id=None):
+    """
+    Worker loop: wait for job, claim and process its shards until coordinator marks it finished.
+    Local workers get job_id and exit after that job; worker started from command line
+    (python file_renamer.py --worker MANIFEST_DIR, also on other machine sharing the filesystem)
+    can be started before the job and keeps serving next jobs until it is stopped.
+    Цикл рабочего процесса: дождаться задания, захватывать и обрабатывать его части, пока координатор не завершит его.
+    Локальные процессы получают job_id и завершаются после этого задания; процесс, запущенный из командной строки
+    (python file_renamer.py --worker MANIFEST_DIR, в том числе на другой машине с общей файловой системой),
+    можно запустить до задания, и он обслуживает следующие задания, пока его не остановят.
+    """
+    manifest_dir = Path(manifest_dir)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    while True:
+        current_job = job_id if job_id is not None else _wait_for_shard_job(manifest_dir)
+        _run_shard_job(manifest_dir, worker_id, current_job)
+        if job_id is not None:
+            return
+
+
+def _run_shard_job(manifest_dir, worker_id, job_id):
+    """
+    Claim and process shards of one job until it is finished or replaced by new job.
+    Захватывать и обрабатывать части одного задания, пока оно не завершено или не заменено новым.
+    """
+    engine = RenameEngine()
+    engine.throttle = IOThrottle()
+    progress_path = manifest_dir / 'progress' / f"{worker_id}.json"
+    progress = {'renamed': 0}
+    # Progress file also registers worker for sharing limits / Файл прогресса также регистрирует процесс для деления ограничений
+    _write_json_atomic(progress_path, progress)
+    last_report = time.monotonic()
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        # Separate thread, so long copies of large files keep the lease / Отдельный поток, чтобы долгое копирование больших файлов сохраняло аренду
+        while not stop_heartbeat.wait(SHARD_HEARTBEAT_INTERVAL):
+            try:
+                os.utime(progress_path)
+            except FileNotFoundError:
+                # Removed progress file would let coordinator requeue claims of working process / Удаленный файл прогресса позволил бы координатору вернуть в очередь части работающего процесса
+                try:
+                    _write_json_atomic(progress_path, dict(progress))
+                except OSError:
+                    continue
+            except OSError:
+                continue
+
+    def refresh_limits():
+        # Job limits are shared equally between live workers / Ограничения задания делятся поровну между работающими процессами
+        limits = read_limits_file(manifest_dir / 'limits.json')
+        if limits is not None:
+            workers = max(1, len(_live_workers(manifest_dir)))
+            engine.throttle.set_limits(limits[0] / workers, limits[1] / workers)
+
+    def on_file_processed(relative_path):
+        nonlocal last_report
+        progress['renamed'] += 1
+        progress['bytes'] = engine.bytes_copied
+        if time.monotonic() - last_report >= SHARD_PROGRESS_INTERVAL:
+            _write_json_atomic(progress_path, progress)
+            refresh_limits()
+            last_report = time.monotonic()
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        while True:
+            refresh_limits()
+            claimed = _claim_next_shard(manifest_dir, worker_id)
+            if claimed is None:
+                if (_read_job_id(manifest_dir / 'FINISHED') == job_id
+                        or _read_job_id(manifest_dir / 'job.json') != job_id):
+                    return
+                time.sleep(SHARD_POLL_INTERVAL)
+                continue
+            result = _process_claimed_shard(engine, manifest_dir, *claimed, on_file_processed=on_file_processed)
+            # Progress is written before result, so coordinator totals are complete / Прогресс пишется до результата, чтобы итоги координатора были полными
+            progress['bytes'] = engine.bytes_copied
+            _write_json_atomic(progress_path, progress)
+            _finish_shard(manifest_dir, *claimed, result)
+    finally:
+        stop_heartbeat.set()
+
+
+class RenameEngine:
+    """
+    Copying and renaming logic without user interface (also used by worker processes).
+    Логика копирования и переименования без интерфейса (используется и рабочими процессами).
+    """
+    # Throughput limits for copying (None - no limits) / Ограничения скорости копирования (None - без ограничений)
+    throttle = None
+    # Bytes copied by this engine (for metrics) / Байты, скопированные этим движком (для метрик)
+    bytes_copied = 0
+
+    def _invalid_filename_chars(self):
+        """
+        Get invalid filename characters for current OS.
+        Получить недопустимые символы для имен файлов текущей ОС.
+        """
+        return '<>:"/\\|?*' if os.name == 'nt' else '/'
+
+    def _sanitize_option(self, value, fallback=""):
+        """
+        Sanitize user input option by removing invalid characters.
+        Очистить пользовательский ввод от недопустимых символов.
+        """
+        if value is None:
+            value = ""
+        invalid_chars = self._invalid_filename_chars()
+        sanitized = ''.join(ch for ch in value if ch not in invalid_chars)
+        if sanitized:
+            return sanitized
+        return fallback
+
+    def _effective_separator(self, separator):
+        """
+        Get effective separator after sanitization.
+        Получить эффективный разделитель после очистки.
+        """
+        sanitized = self._sanitize_option(separator, fallback="")
+        if not sanitized and separator:
+            # If user entered only invalid chars, use safe default / Если пользователь указал только запрещенные символы, используем безопасный дефолт
+            return "_"
+        return sanitized
+
+    def _effective_quote(self, quote):
+        """
+        Get effective quote character after sanitization.
+        Получить эффективный символ кавычек после очистки.
+        """
+        fallback = "'" if os.name == 'nt' else ""
+        sanitized = self._sanitize_option(quote, fallback=fallback)
+        return sanitized
+
+    def _sanitize_output_name(self, name):
+        """
+        Sanitize output filename by removing invalid characters.
+        Очистить имя выходного файла от недопустимых символов.
+        """
+        if name is None:
+            return "_"
+        invalid_chars = self._invalid_filename_chars()
+        sanitized = ''.join(ch for ch in name if ch not in invalid_chars and ch != '\0')
+        sanitized = sanitized.strip()
+        if os.name == 'nt':
+            sanitized = sanitized.rstrip('. ')
+        return sanitized or "_"
+
+    def _copy_function_for_level(self, metadata_level):
+        """
+        Get file copy function for metadata level.
+        Получить функцию копирования файла для уровня метаданных.
+        """
+        copyfile = self.throttle.copyfile if self.throttle is not None else shutil.copyfile
+        if metadata_level == METADATA_NONE:
+            return copyfile
+        if metadata_level == METADATA_TIMES:
+            def copy_with_times(src, dst):
+                copyfile(src, dst)
+                st = os.stat(src)
+                os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+                return dst
+            return copy_with_times
+        if self.throttle is None:
+            return shutil.copy2
+        def copy_with_stat(src, dst):
+            # Same as shutil.copy2 with limited data copying / То же, что shutil.copy2, с ограниченным копированием данных
+            copyfile(src, dst)
+            shutil.copystat(src, dst)
+            return dst
+        return copy_with_stat
+
+    def make_plan_dirs(self, plan, dest_path, failures=None):
+        """
+        Create destination folders of plan and return their paths (index = folder id).
+        Failed folders are added to failures list (stage 'mkdir'); without it, and for root folder, OSError is raised.
+        Создать папки назначения плана и вернуть их пути (индекс = id папки).
+        Неудачные папки добавляются в список failures (этап 'mkdir'); без него, а также для корневой папки выбрасывается OSError.
+        """
+        dst_dirs = plan.dir_paths(dest_path)
+        for dir_id, dst_dir in enumerate(dst_dirs):
+            try:
+                retry_io(os.makedirs, dst_dir, 0o777, True)
+            except OSError as e:
+                if failures is None or dir_id == plan.ROOT:
+                    raise
+                failures.append(failure_record('mkdir', plan.dir_relative_path(dir_id), e))
+        return dst_dirs
+
+    def copy_tree(self, source_path, dest_path, metadata_level=METADATA_FULL, plan=None, failures=None, on_file_copied=None):
+        """
+        Copy folder structure with selected metadata level.
+        Returns RenamePlan of copied tree (scanned if not given).
+        Failed files are added to failures list; without it shutil.Error is raised at the end.
+        on_file_copied(file index, copied path) is called after every copied file.
+        Копирует структуру папок с выбранным уровнем метаданных.
+        Возвращает RenamePlan скопированного дерева (сканируется, если не передан).
+        Неудачные файлы добавляются в список failures; без него в конце выбрасывается shutil.Error.
+        on_file_copied(индекс файла, путь копии) вызывается после каждого скопированного файла.
+        """
+        if plan is None:
+            plan = RenamePlan.scan(source_path, failures)
+        copy_file = self._copy_function_for_level(metadata_level)
+        errors = []
+        src_dirs = plan.dir_paths(source_path)
+        dst_dirs = self.make_plan_dirs(plan, dest_path, failures)
+        for index in range(len(plan)):
+            name = plan.file_name(index)
+            dir_id = plan.file_dir[index]
+            src_item = os.path.join(src_dirs[dir_id], name)
+            dst_item = os.path.join(dst_dirs[dir_id], name)
+            try:
+                retry_io(copy_file, src_item, dst_item)
+                self.bytes_copied += plan.file_size[index]
+            except OSError as e:
+                if failures is None:
+                    errors.append((src_item, dst_item, str(e)))
+                else:
+                    failures.append(failure_record('copy', plan.relative_path(index), e))
+                continue
+            if on_file_copied is not None:
+                on_file_copied(index, dst_item)
+        if errors:
+            raise shutil.Error(errors)
+        return plan
+
+    def copy_file_fanout(self, src, targets):
+        """
+        Copy file to several (destination, metadata level) targets reading source once.
+        Returns {destination: error} of failed targets; source errors are raised.
+        Копировать файл в несколько целей (назначение, уровень метаданных), читая источник один раз.
+        Возвращает {назначение: ошибка} неудачных целей; ошибки источника выбрасываются.
+        """
+        if len(targets) == 1:
+            dst, metadata_level = targets[0]
+            self._copy_function_for_level(metadata_level)(src, dst)
+            return {}
+        errors = copyfile_fanout(src, [dst for dst, metadata_level in targets], self.throttle)
+        st = None
+        for dst, metadata_level in targets:
+            if dst in errors:
+                continue
+            try:
+                if metadata_level == METADATA_TIMES:
+                    st = st or os.stat(src)
+                    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+                elif metadata_level == METADATA_FULL:
+                    shutil.copystat(src, dst)
+            except OSError as e:
+                errors[dst] = e
+        return errors
+
+    def member_plan(self, plan, source_path, member_source):
+        """
+        Plan of nested or identical source inside plan of source_path and indices of its files.
+        План вложенного или совпадающего источника внутри плана source_path и индексы его файлов.
+        """
+        relative = os.path.relpath(os.path.realpath(member_source), os.path.realpath(source_path))
+        dir_id = plan.find_dir([] if relative == os.curdir else relative.split(os.sep))
+        if dir_id is None:
+            raise FileNotFoundError(errno.ENOENT, "Папка не найдена в дереве источника", os.fspath(member_source))
+        return plan.subplan(dir_id)
+
+    def copy_tree_fanout(self, source_path, plan, members):
+        """
+        Copy source tree once into destinations of members.
+        Member is dict with 'plan', 'indices' (None for whole plan), 'dest_path', 'metadata', 'failures'
+        and 'on_file_copied' (see copy_tree, may be None).
+        Копировать дерево источника один раз в папки назначения участников.
+        Участник - словарь с 'plan', 'indices' (None для всего плана), 'dest_path', 'metadata', 'failures'
+        и 'on_file_copied' (см. copy_tree, может быть None).
+        """
+        src_dirs = plan.dir_paths(source_path)
+        member_dirs = [self.make_plan_dirs(member['plan'], member['dest_path'], member['failures']) for member in members]
+        # Member indices are increasing, so one position per member is enough / Индексы участника возрастают, поэтому достаточно одной позиции на участника
+        positions = [0] * len(members)
+        for index in range(len(plan)):
+            targets = []
+            for n, member in enumerate(members):
+                indices = member['indices']
+                if indices is None:
+                    targets.append((n, index))
+                elif positions[n] < len(indices) and indices[positions[n]] == index:
+                    targets.append((n, positions[n]))
+                    positions[n] += 1
+            if not targets:
+                continue
+            name = plan.file_name(index)
+            src_item = os.path.join(src_dirs[plan.file_dir[index]], name)
+            destinations = [
+                (os.path.join(member_dirs[n][members[n]['plan'].file_dir[member_index]], name), members[n]['metadata'])
+                for n, member_index in targets
+            ]
+            try:
+                errors = retry_io(self.copy_file_fanout, src_item, destinations)
+            except OSError as e:
+                for n, member_index in targets:
+                    members[n]['failures'].append(failure_record('copy', members[n]['plan'].relative_path(member_index), e))
+                continue
+            for (n, member_index), (dst_item, metadata_level) in zip(targets, destinations):
+                if dst_item in errors:
+                    # Failed destination is copied alone, so only its pair gets the failure / Неудачное назначение копируется отдельно, чтобы ошибку получила только его пара
+                    try:
+                        retry_io(self._copy_function_for_level(metadata_level), src_item, dst_item)
+                    except OSError as e:
+                        members[n]['failures'].append(failure_record('copy', members[n]['plan'].relative_path(member_index), e))
+                        continue
+                self.bytes_copied += plan.file_size[index]
+                if members[n]['on_file_copied'] is not None:
+                    members[n]['on_file_copied'](member_index, dst_item)
+
+    def copy_directory_metadata(self, src_dir, dst_dir, metadata_level=METADATA_FULL):
+        """
+        Copy metadata of one directory for metadata level.
+        Скопировать метаданные одной папки для уровня метаданных.
+        """
+        if metadata_level == METADATA_TIMES:
+            st = os.stat(src_dir)
+            os.utime(dst_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+        elif metadata_level == METADATA_FULL:
+            shutil.copystat(src_dir, dst_dir)
+
+    def apply_directory_metadata(self, plan, source_path, dest_path, metadata_level=METADATA_FULL, failures=None):
+        """
+        Apply metadata to copied directories in one pass.
+        Failed directories are added to failures list (stage 'dirmeta'); without it OSError is raised.
+        Применить метаданные к скопированным папкам за один проход.
+        Неудачные папки добавляются в список failures (этап 'dirmeta'); без него выбрасывается OSError.
+        """
+        if metadata_level == METADATA_NONE:
+            return
+        for dir_id, (src_dir, dst_dir) in enumerate(zip(plan.dir_paths(source_path), plan.dir_paths(dest_path))):
+            try:
+                retry_io(self.copy_directory_metadata, src_dir, dst_dir, metadata_level)
+            except OSError as e:
+                if failures is None:
+                    raise
+                failures.append(failure_record('dirmeta', plan.dir_relative_path(dir_id), e))
+
+    def _build_new_name(self, folder_names, file_name, file_extension, safe_separator, safe_quote):
+        """
+        Build new filename from folder names with sanitized separator and quote.
+        Построить новое имя файла из названий папок с очищенными разделителем и кавычками.
+        """
+        # Combine folder names with user parameters / Объединяем названия папок с пользовательскими параметрами
+        components = []
+        if folder_names:
+            components.extend([f"{safe_quote}{name}{safe_quote}" if safe_quote else name for name in folder_names])
+        components.append(file_name)
+
+        if safe_separator:
+            base_name = safe_separator.join(components)
+        else:
+            base_name = ''.join(components)
+
+        sanitized_base = self._sanitize_output_name(base_name)
+        return f"{sanitized_base}{file_extension}"
+
+    def plan_targets(self, plan, separator=" + ", quote='"', include_root=False, root_name=None):
+        """
+        Yield (file index, new filename) for files of plan using naming rules.
+        Выдает (индекс файла, новое имя) для файлов плана по правилам именования.
+        """
+        safe_quote = self._effective_quote(quote or '')
+        safe_separator = self._effective_separator(separator or '')
+        folder_names_cache = {}
+        
+        for index in range(len(plan)):
+            dir_id = plan.file_dir[index]
+            folder_names = folder_names_cache.get(dir_id)
+            if folder_names is None:
+                # Cache only holds current folder, files of folder are stored together / Кэш хранит только текущую папку, файлы папки хранятся подряд
+                folder_names_cache.clear()
+                folder_names = plan.dir_parts(dir_id)
+                if include_root and root_name:
+                    folder_names = [root_name] + folder_names
+                folder_names_cache[dir_id] = folder_names
+            yield index, self._build_new_name(folder_names, plan.stem(index), plan.suffix(index), safe_separator, safe_quote)
+
+    def rename_files_from_plan(self, plan, root_path, failures, separator=" + ", quote='"', include_root=False, root_name=None, on_file_processed=None, before_rename=None):
+        """
+        Rename copied files listed in plan.
+        Unlike directory iteration, files renamed during the pass are never visited twice.
+        Files already in failures list (not copied) are skipped, rename failures are added to it.
+        before_rename(path) is called before copied file is renamed (e.g. to wait for its verification).
+        Переименовывает скопированные файлы из плана.
+        В отличие от обхода директорий, переименованные файлы не попадают в обход повторно.
+        Файлы из списка failures (не скопированные) пропускаются, ошибки переименования добавляются в него.
+        before_rename(путь) вызывается перед переименованием копии (например, чтобы дождаться ее проверки).
+        """
+        total_renamed = 0
+        failed_paths = {failure['path'] for failure in failures}
+        dir_paths = plan.dir_paths(root_path)
+        
+        for index, new_name in self.plan_targets(plan, separator, quote, include_root, root_name):
+            dir_id = plan.file_dir[index]
+            old_name = plan.file_name(index)
+            
+            if failed_paths and plan.relative_path(index) in failed_paths:
+                continue
+            
+            new_path = os.path.join(dir_paths[dir_id], new_name)
+            if new_name != old_name:  # Avoid renaming to same name / Избегаем переименования в то же имя
+                item = os.path.join(dir_paths[dir_id], old_name)
+                if before_rename is not None:
+                    before_rename(item)
+                try:
+                    retry_io(os.rename, item, new_path)
+                    total_renamed += 1
+                    if on_file_processed is not None:
+                        try:
+                            on_file_processed(plan.relative_path(index))
+                        except Exception:
+                            pass
+                except Exception as e:
+                    failures.append(failure_record('rename', plan.relative_path(index), e))
+                    continue
+        
+        return total_renamed
+
+    def mirror_target(self, pair, relative_path, separator=" + ", quote='"', include_root=False):
+        """
+        Destination path of renamed file for source relative path.
+        Путь переименованного файла в папке назначения для относительного пути источника.
+        """
+        relative_path = Path(relative_path)
+        folder_names = list(relative_path.parts[:-1])
+        if include_root:
+            folder_names = [Path(pair['source']).name] + folder_names
+        new_name = self._build_new_name(
+            folder_names, relative_path.stem, relative_path.suffix,
+            self._effective_separator(separator or ''), self._effective_quote(quote or '')
+        )
+        return Path(pair['destination']) / relative_path.parent / new_name
+
+    def retry_failed_path(self, pair, relative_path, separator=" + ", quote='"', include_root=False):
+        """
+        Redo one failed file: copy it to its final name and remove copy left under original name.
+        Повторить один неудачный файл: скопировать под итоговым именем и удалить копию с исходным именем.
+        """
+        mirrored = retry_io(self.mirror_path, pair, relative_path, separator, quote, include_root)
+        leftover = Path(pair['destination']) / relative_path
+        if leftover != self.mirror_target(pair, relative_path, separator, quote, include_root) and leftover.is_file():
+            retry_io(os.remove, leftover)
+        return mirrored
+
+    def mirror_path(self, pair, relative_path, separator=" + ", quote='"', include_root=False):
+        """
+        Mirror one source path into destination using naming rules.
+        Returns number of copied files.
+        Отразить один путь исходной папки в папке назначения по правилам именования.
+        Возвращает количество скопированных файлов.
+        """
+        source_path = Path(pair['source'])
+        dest_path = Path(pair['destination'])
+        relative_path = Path(relative_path)
+        src_item = source_path / relative_path
+        
+        if src_item.is_dir():
+            mirrored = 0
+            for current, dirs, names in os.walk(src_item):
+                current_rel = Path(current).relative_to(source_path)
+                for name in names:
+                    mirrored += self.mirror_path(pair, current_rel / name, separator, quote, include_root)
+            return mirrored
+        
+        dst_item = self.mirror_target(pair, relative_path, separator, quote, include_root)
+        dst_dir = dst_item.parent
+        new_name = dst_item.name
+        
+        if not src_item.exists():
+            # Source removed: remove mirrored folder or file / Источник удален: удаляем отраженную папку или файл
+            if (dest_path / relative_path).is_dir():
+                rmtree_with_retry(dest_path / relative_path)
+            elif dst_item.exists():
+                dst_item.unlink()
+            return 0
+        
+        # Copy through temporary file so readers never see partial file / Копируем через временный файл, чтобы не было видно недописанного файла
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        tmp_item = dst_dir / f".{new_name}.tmp"
+        copy_file = self._copy_function_for_level(pair.get('metadata', METADATA_FULL))
+        try:
+            retry_io(copy_file, src_item, tmp_item)
+            retry_io(os.replace, tmp_item, dst_item)
+        finally:
+            if tmp_item.exists():
+                tmp_item.unlink()
+        return 1
+
+    def process_shard(self, shard, on_file_processed=None):
+        """
+        Copy and rename files of one shard.
+        Скопировать и переименовать файлы одной части задания.
+        """
+        plan = RenamePlan.from_folders(shard['folders'])
+        dest_path = Path(shard['destination'])
+        set_io_priority(shard.get('priority', PRIORITY_NORMAL))
+        failures = []
+        self.copy_tree(shard['source'], dest_path, shard['metadata'], plan=plan, failures=failures)
+        renamed = self.rename_files_from_plan(
+            plan, dest_path,
+            separator=shard['separator'],
+            quote=shard['quote'],
+            include_root=shard['include_root'],
+            root_name=shard['root_name'],
+            on_file_processed=on_file_processed,
+            failures=failures
+        )
+        return {'renamed': renamed, 'failures': failures}
+
+
+class FileRenamerApp(RenameEngine):
     """
     Main application class for file renaming.
     Главный класс приложения для переименования файлов.
@@ -20,7 +1830,7 @@ class FileRenamerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Программа переименования файлов")
-        self.root.geometry("1000x820")
+        self.root.geometry("1000x900")
         self.root.resizable(True, True)
         
         # List of folder pairs (source -> destination) / Список пар папок (исходная -> назначение)
@@ -29,14 +1839,54 @@ class FileRenamerApp:
         self.editing_index = None
         # ID of Treeview item being edited (for row update) / ID элемента Treeview, который редактируем (для обновления строки)
         self.editing_item_id = None
+        # Active watchers of watch mode / Активные наблюдатели режима слежения
+        self.watchers = []
+        # Stopped watchers that may still finish current file / Остановленные наблюдатели, которые могут заканчивать текущий файл
+        self.stopping_watchers = []
+        # Local worker processes of sharded processing / Локальные рабочие процессы обработки частями
+        self.shard_processes = []
+        self.shard_local_ids = set()
         
         # Global settings: separator and quotes for names / Глобальные настройки: разделитель и кавычки для имен
         self.separator_var = tk.StringVar(value=" + ")
         default_quote = "'" if os.name == 'nt' else '"'
         self.quote_var = tk.StringVar(value=default_quote)
         self.include_root_var = tk.BooleanVar(value=False)
+        # Metadata level for new pair (label from METADATA_LEVELS) / Уровень метаданных для новой пары (подпись из METADATA_LEVELS)
+        self.metadata_level_var = tk.StringVar(value=METADATA_LEVELS[METADATA_FULL])
+        # Priority for new pair (label from PRIORITY_LEVELS) / Приоритет для новой пары (подпись из PRIORITY_LEVELS)
+        self.priority_var = tk.StringVar(value=PRIORITY_LEVELS[PRIORITY_NORMAL])
+        # Processing settings: worker processes (0 - off) and shared manifest folder / Настройки обработки: рабочие процессы (0 - выкл.) и общая папка манифеста
+        self.shard_workers_var = tk.IntVar(value=0)
+        self.shard_manifest_var = tk.StringVar(value="")
+        # Throughput limits, 0 - no limit (can be changed during processing) / Ограничения скорости, 0 - без ограничения (можно менять во время обработки)
+        self.throttle = IOThrottle()
+        self.max_mbps_var = tk.StringVar(value="0")
+        self.max_files_var = tk.StringVar(value="0")
+        # File written before start is ignored, so old --set-limits calls do not throttle new runs / Файл, записанный до запуска, игнорируется, чтобы старые вызовы --set-limits не ограничивали новые запуски
+        self.limits_control_mtime = self._limits_control_mtime()
+        # Copy verification with checksum manifest / Проверка копий с манифестом контрольных сумм
+        self.verify_var = tk.BooleanVar(value=False)
+        self.verifier = None
+        # Metrics endpoint: local port (0 - off) and textfile / Метрики: локальный порт (0 - выкл.) и текстовый файл
+        self.metrics_port_var = tk.StringVar(value="0")
+        self.metrics_textfile_var = tk.StringVar(value="")
+        self.metrics = None
+        self.metrics_lock = threading.Lock()
+        self.metrics_samples = deque()
+        # Job state read by metrics / Состояние задания для метрик
+        self.total_files = 0
+        self.pair_file_counts = []
+        self.processed_files = 0
+        self.total_failures = 0
+        self.unsaved_failure_lists = []
+        self.job_running = False
+        self.job_started = 0.0
+        self.pair_states = {}
+        self.pair_failures_live = {}
         
         self.setup_ui()
+        self.poll_limits_control()
         
     def setup_ui(self):
         """
@@ -88,20 +1938,32 @@ class FileRenamerApp:
         ttk.Button(add_frame, text="Выбрать", 
                   command=self.select_destination_folder).grid(row=1, column=2, pady=5)
         
+        # Metadata level selection / Выбор уровня метаданных
+        ttk.Label(add_frame, text="Метаданные файлов:").grid(row=2, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(add_frame, textvariable=self.metadata_level_var, values=list(METADATA_LEVELS.values()),
+                     state='readonly', width=38).grid(row=2, column=1, sticky=(tk.W, tk.E), padx=(5, 5), pady=5)
+        
+        # Priority selection / Выбор приоритета
+        priority_frame = ttk.Frame(add_frame)
+        priority_frame.grid(row=2, column=2, columnspan=2, sticky=tk.W, pady=5)
+        ttk.Label(priority_frame, text="Приоритет:").pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Combobox(priority_frame, textvariable=self.priority_var, values=list(PRIORITY_LEVELS.values()),
+                     state='readonly', width=26).pack(side=tk.LEFT)
+        
         # Default folder creation button / Кнопка создания папки по умолчанию
         self.create_default_btn = ttk.Button(add_frame, text="Создать папку сохранения", 
                   command=self.create_default_destination)
-        self.create_default_btn.grid(row=2, column=1, pady=5)
+        self.create_default_btn.grid(row=3, column=1, pady=5)
         
         # Add folder pair button / Кнопка добавления пары папок
         self.add_pair_btn = ttk.Button(add_frame, text="Добавить в список", 
                                      command=self.add_folder_pair, style="Accent.TButton")
-        self.add_pair_btn.grid(row=2, column=2, pady=5)
+        self.add_pair_btn.grid(row=3, column=2, pady=5)
         
         # Cancel editing button / Кнопка отмены редактирования
         self.cancel_edit_btn = ttk.Button(add_frame, text="Отмена редактирования", 
                                         command=self.cancel_edit)
-        self.cancel_edit_btn.grid(row=2, column=3, pady=5)
+        self.cancel_edit_btn.grid(row=3, column=3, pady=5)
         self.cancel_edit_btn.config(state='disabled')
         
         # Name formatting settings / Настройки форматирования имен
@@ -130,16 +1992,20 @@ class FileRenamerApp:
         table_frame.rowconfigure(0, weight=1)
         
         # Create Treeview for displaying folder pairs / Создаем Treeview для отображения пар папок
-        columns = ('source', 'destination')
+        columns = ('source', 'destination', 'metadata', 'priority')
         self.folder_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=10, style="Modern.Treeview")
         
         # Configure headers / Настройка заголовков
         self.folder_tree.heading('source', text='Исходная папка')
         self.folder_tree.heading('destination', text='Папка назначения')
+        self.folder_tree.heading('metadata', text='Метаданные')
+        self.folder_tree.heading('priority', text='Приоритет')
         
         # Configure columns / Настройка колонок
-        self.folder_tree.column('source', width=420, minwidth=220)
-        self.folder_tree.column('destination', width=420, minwidth=220)
+        self.folder_tree.column('source', width=290, minwidth=200)
+        self.folder_tree.column('destination', width=290, minwidth=200)
+        self.folder_tree.column('metadata', width=150, minwidth=100)
+        self.folder_tree.column('priority', width=110, minwidth=80)
         
         # Scrollbar for table / Скроллбар для таблицы
         scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.folder_tree.yview, style="Modern.Vertical.TScrollbar")
@@ -161,9 +2027,58 @@ class FileRenamerApp:
         ttk.Button(control_frame, text="Очистить все", 
                   command=self.clear_all_pairs).pack(side=tk.LEFT, padx=6)
         
+        # Processing settings / Настройки обработки
+        processing_frame = ttk.LabelFrame(main_frame, text="Настройки обработки", padding="10", style="Card.TLabelframe")
+        processing_frame.grid(row=4, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(0, 10))
+        processing_frame.columnconfigure(3, weight=1)
+        
+        ttk.Label(processing_frame, text="Рабочих процессов (0 — без разделения):").grid(row=0, column=0, sticky=tk.W, pady=5)
+        ttk.Spinbox(processing_frame, from_=0, to=64, textvariable=self.shard_workers_var, width=6).grid(row=0, column=1, sticky=tk.W, padx=(5, 15), pady=5)
+        ttk.Label(processing_frame, text="Папка манифеста:").grid(row=0, column=2, sticky=tk.W, pady=5)
+        manifest_entry = ttk.Entry(processing_frame, textvariable=self.shard_manifest_var, width=30)
+        manifest_entry.grid(row=0, column=3, sticky=(tk.W, tk.E), padx=(5, 5), pady=5)
+        self.create_tooltip(manifest_entry, 
+                           "Общая папка для заданий рабочих процессов. Процессы на других машинах запускаются командой: "
+                           "python file_renamer.py --worker <папка манифеста>. Если не указана, используется временная папка")
+        
+        # Throughput limits / Ограничения скорости
+        limits_frame = ttk.Frame(processing_frame)
+        limits_frame.grid(row=1, column=0, columnspan=4, sticky=tk.W, pady=5)
+        ttk.Label(limits_frame, text="Лимит МБ/с:").pack(side=tk.LEFT)
+        ttk.Entry(limits_frame, textvariable=self.max_mbps_var, width=8).pack(side=tk.LEFT, padx=(5, 15))
+        ttk.Label(limits_frame, text="Лимит файлов/с:").pack(side=tk.LEFT)
+        ttk.Entry(limits_frame, textvariable=self.max_files_var, width=8).pack(side=tk.LEFT, padx=(5, 15))
+        apply_limits_btn = ttk.Button(limits_frame, text="Применить", command=self.apply_limits)
+        apply_limits_btn.pack(side=tk.LEFT)
+        self.create_tooltip(apply_limits_btn, 
+                           "0 — без ограничения. Лимиты применяются сразу, в том числе к идущей обработке. "
+                           "Из командной строки: python file_renamer.py --set-limits --max-mbps 20 --max-files-per-sec 500")
+        
+        # Copy verification / Проверка копий
+        verify_check = ttk.Checkbutton(processing_frame, text="Проверять копии (размеры и контрольные суммы SHA-256)", variable=self.verify_var)
+        verify_check.grid(row=2, column=0, columnspan=4, sticky=tk.W, pady=(4, 0))
+        self.create_tooltip(verify_check, 
+                           "Каждый файл назначения сравнивается с исходным во время копирования. Результат сохраняется "
+                           "в подписанный манифест <папка назначения>.sha256.jsonl, несовпадения попадают в список ошибок. "
+                           "Подпись проверяется командой: python file_renamer.py --verify-manifest <манифест>")
+        
+        # Metrics endpoint / Метрики для мониторинга
+        metrics_frame = ttk.Frame(processing_frame)
+        metrics_frame.grid(row=3, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(5, 0))
+        metrics_frame.columnconfigure(3, weight=1)
+        ttk.Label(metrics_frame, text="Порт метрик (0 — выкл.):").grid(row=0, column=0, sticky=tk.W)
+        ttk.Entry(metrics_frame, textvariable=self.metrics_port_var, width=8).grid(row=0, column=1, sticky=tk.W, padx=(5, 15))
+        ttk.Label(metrics_frame, text="Файл метрик:").grid(row=0, column=2, sticky=tk.W)
+        ttk.Entry(metrics_frame, textvariable=self.metrics_textfile_var, width=30).grid(row=0, column=3, sticky=(tk.W, tk.E), padx=(5, 5))
+        apply_metrics_btn = ttk.Button(metrics_frame, text="Применить", command=self.apply_metrics)
+        apply_metrics_btn.grid(row=0, column=4, sticky=tk.W)
+        self.create_tooltip(apply_metrics_btn, 
+                           f"Метрики в формате Prometheus: http://{METRICS_HOST}:<порт>/metrics и/или файл "
+                           "для textfile collector (node_exporter). Из командной строки: --metrics-port, --metrics-textfile")
+        
         # Information area / Информационная область
         info_frame = ttk.LabelFrame(main_frame, text="Информация", padding="10", style="Card.TLabelframe")
-        info_frame.grid(row=4, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=10)
+        info_frame.grid(row=5, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=10)
         info_frame.columnconfigure(0, weight=1)
         
         info_text = """Программа переименует файлы, добавив к их именам названия всех родительских папок.
@@ -175,22 +2090,34 @@ class FileRenamerApp:
         
         # Progress bar / Прогресс бар
         self.progress = ttk.Progressbar(main_frame, mode='determinate', style="Modern.Horizontal.TProgressbar")
-        self.progress.grid(row=5, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(10, 4))
+        self.progress.grid(row=6, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(10, 4))
         # Current pair progress / Прогресс текущей пары
         self.progress_pair = ttk.Progressbar(main_frame, mode='determinate', style="Modern.Horizontal.TProgressbar")
-        self.progress_pair.grid(row=6, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(0, 10))
+        self.progress_pair.grid(row=7, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(0, 10))
         
-        # Start button / Кнопка запуска
-        self.start_button = ttk.Button(main_frame, text="ЗАПУСТИТЬ ОБРАБОТКУ", 
+        # Start and watch buttons / Кнопки запуска и слежения
+        buttons_frame = ttk.Frame(main_frame)
+        buttons_frame.grid(row=8, column=0, columnspan=4, pady=20)
+        self.start_button = ttk.Button(buttons_frame, text="ЗАПУСТИТЬ ОБРАБОТКУ", 
                                      command=self.start_renaming, style="Accent.TButton")
-        self.start_button.grid(row=7, column=0, columnspan=4, pady=20)
+        self.start_button.pack(side=tk.LEFT, padx=(0, 6))
+        self.watch_button = ttk.Button(buttons_frame, text="Следить за папками", 
+                                     command=self.toggle_watching)
+        self.watch_button.pack(side=tk.LEFT, padx=6)
+        self.retry_button = ttk.Button(buttons_frame, text="Повторить ошибки", 
+                                     command=self.start_retry_failures)
+        self.retry_button.pack(side=tk.LEFT, padx=6)
+        self.create_tooltip(self.retry_button, 
+                           "Повторно копирует и переименовывает только файлы, которые не удалось обработать в прошлый раз")
+        self.create_tooltip(self.watch_button, 
+                           "Новые и измененные файлы исходных папок сразу копируются и переименовываются в папки назначения")
         
         # Status / Статус
         self.status_label = ttk.Label(main_frame, text="Готов к работе")
-        self.status_label.grid(row=8, column=0, columnspan=4, pady=5)
+        self.status_label.grid(row=9, column=0, columnspan=4, pady=5)
         # Detailed progress / Детальный прогресс
         self.progress_text = ttk.Label(main_frame, text="")
-        self.progress_text.grid(row=9, column=0, columnspan=4, pady=(0,5))
+        self.progress_text.grid(row=10, column=0, columnspan=4, pady=(0,5))
 
         # Prepare alternating rows / Подготовка чередующихся строк
         self.folder_tree.tag_configure('oddrow', background=self._get_color('table_row_alt'))
@@ -289,59 +2216,35 @@ class FileRenamerApp:
             tag = 'evenrow' if index % 2 == 0 else 'oddrow'
             self.folder_tree.item(item_id, tags=(tag,))
 
-    def _invalid_filename_chars(self):
-        """
-        Get invalid filename characters for current OS.
-        Получить недопустимые символы для имен файлов текущей ОС.
-        """
-        return '<>:"/\\|?*' if os.name == 'nt' else '/'
-
-    def _sanitize_option(self, value, fallback=""):
-        """
-        Sanitize user input option by removing invalid characters.
-        Очистить пользовательский ввод от недопустимых символов.
-        """
-        if value is None:
-            value = ""
-        invalid_chars = self._invalid_filename_chars()
-        sanitized = ''.join(ch for ch in value if ch not in invalid_chars)
-        if sanitized:
-            return sanitized
-        return fallback
-
-    def _effective_separator(self, separator):
+    def _metadata_level_from_label(self, label):
         """
-        Get effective separator after sanitization.
-        Получить эффективный разделитель после очистки.
+        Get metadata level key by its displayed label.
+        Получить ключ уровня метаданных по отображаемой подписи.
         """
-        sanitized = self._sanitize_option(separator, fallback="")
-        if not sanitized and separator:
-            # If user entered only invalid chars, use safe default / Если пользователь указал только запрещенные символы, используем безопасный дефолт
-            return "_"
-        return sanitized
+        for level, level_label in METADATA_LEVELS.items():
+            if level_label == label:
+                return level
+        return METADATA_FULL
 
-    def _effective_quote(self, quote):
+    def _priority_from_label(self, label):
         """
-        Get effective quote character after sanitization.
-        Получить эффективный символ кавычек после очистки.
+        Get priority key by its displayed label.
+        Получить ключ приоритета по отображаемой подписи.
         """
-        fallback = "'" if os.name == 'nt' else ""
-        sanitized = self._sanitize_option(quote, fallback=fallback)
-        return sanitized
+        for priority, priority_label in PRIORITY_LEVELS.items():
+            if priority_label == label:
+                return priority
+        return PRIORITY_NORMAL
 
-    def _sanitize_output_name(self, name):
+    def _pair_row_values(self, pair):
         """
-        Sanitize output filename by removing invalid characters.
-        Очистить имя выходного файла от недопустимых символов.
+        Get table row values for folder pair.
+        Получить значения строки таблицы для пары папок.
         """
-        if name is None:
-            return "_"
-        invalid_chars = self._invalid_filename_chars()
-        sanitized = ''.join(ch for ch in name if ch not in invalid_chars and ch != '\0')
-        sanitized = sanitized.strip()
-        if os.name == 'nt':
-            sanitized = sanitized.rstrip('. ')
-        return sanitized or "_"
+        metadata_level = pair.get('metadata', METADATA_FULL)
+        priority = pair.get('priority', PRIORITY_NORMAL)
+        return (pair['source'], pair['destination'], METADATA_LEVELS.get(metadata_level, metadata_level),
+                PRIORITY_LEVELS.get(priority, priority))
     
     def create_tooltip(self, widget, text):
         """
@@ -409,17 +2312,23 @@ class FileRenamerApp:
             return
         
         # Check if pair already exists / Проверяем, не добавлена ли уже такая пара
+        # Same source may go to several destinations, it is read once / Один источник может идти в несколько назначений, он читается один раз
         for pair in self.folder_pairs:
-            if pair['source'] == source:
-                messagebox.showwarning("Предупреждение", "Эта исходная папка уже добавлена в список!")
+            if pair['source'] == source and pair['destination'] == destination:
+                messagebox.showwarning("Предупреждение", "Эта пара папок уже добавлена в список!")
                 return
         
         # Add pair to list / Добавляем пару в список
-        pair = {'source': source, 'destination': destination}
+        pair = {
+            'source': source,
+            'destination': destination,
+            'metadata': self._metadata_level_from_label(self.metadata_level_var.get()),
+            'priority': self._priority_from_label(self.priority_var.get()),
+        }
         self.folder_pairs.append(pair)
         
         # Add to table / Добавляем в таблицу
-        new_id = self.folder_tree.insert('', 'end', values=(source, destination))
+        new_id = self.folder_tree.insert('', 'end', values=self._pair_row_values(pair))
         self.refresh_treeview_stripes()
         
         # Clear input fields / Очищаем поля ввода
@@ -438,12 +2347,11 @@ class FileRenamerApp:
             messagebox.showwarning("Предупреждение", "Выберите пару для удаления!")
             return
         
-        # Get selected item index / Получаем индекс выбранного элемента
-        item = self.folder_tree.item(selected[0])
-        source = item['values'][0]
+        # Get selected item index, rows are in list order / Получаем индекс выбранного элемента, строки идут в порядке списка
+        index = self.folder_tree.index(selected[0])
         
         # Remove from list / Удаляем из списка
-        self.folder_pairs = [pair for pair in self.folder_pairs if pair['source'] != source]
+        del self.folder_pairs[index]
         
         # Remove from table / Удаляем из таблицы
         self.folder_tree.delete(selected[0])
@@ -494,6 +2402,8 @@ class FileRenamerApp:
         self.editing_item_id = item_id
         self.source_folder_var.set(source)
         self.destination_folder_var.set(destination)
+        self.metadata_level_var.set(METADATA_LEVELS[self.folder_pairs[pair_index].get('metadata', METADATA_FULL)])
+        self.priority_var.set(PRIORITY_LEVELS[self.folder_pairs[pair_index].get('priority', PRIORITY_NORMAL)])
         self.add_pair_btn.config(text="Сохранить изменения", command=self.save_edit_pair)
         self.cancel_edit_btn.config(state='normal')
         self.status_label.config(text="Режим редактирования пары")
@@ -515,19 +2425,21 @@ class FileRenamerApp:
             messagebox.showerror("Ошибка", "Исходная папка не существует!")
             return
         
-        # Check for duplicates by source among other pairs / Проверяем дубликаты по source среди других пар
+        # Check for duplicate pairs among other pairs / Проверяем дубликаты пар среди других пар
         for i, pair in enumerate(self.folder_pairs):
-            if i != self.editing_index and pair['source'] == new_source:
-                messagebox.showwarning("Предупреждение", "Эта исходная папка уже есть в списке!")
+            if i != self.editing_index and pair['source'] == new_source and pair['destination'] == new_destination:
+                messagebox.showwarning("Предупреждение", "Эта пара папок уже есть в списке!")
                 return
         
         # Update data / Обновляем данные
         self.folder_pairs[self.editing_index]['source'] = new_source
         self.folder_pairs[self.editing_index]['destination'] = new_destination
+        self.folder_pairs[self.editing_index]['metadata'] = self._metadata_level_from_label(self.metadata_level_var.get())
+        self.folder_pairs[self.editing_index]['priority'] = self._priority_from_label(self.priority_var.get())
         
         # Update table row / Обновляем строку таблицы
         if self.editing_item_id:
-            self.folder_tree.item(self.editing_item_id, values=(new_source, new_destination))
+            self.folder_tree.item(self.editing_item_id, values=self._pair_row_values(self.folder_pairs[self.editing_index]))
         
         # Exit edit mode / Выходим из режима редактирования
         self.source_folder_var.set("")
@@ -599,7 +2511,7 @@ class FileRenamerApp:
                 return
             self.folder_pairs[pair_index]['destination'] = new_dest
             # Update table row / Обновляем строку в таблице
-            self.folder_tree.item(item_id, values=(source_path, new_dest))
+            self.folder_tree.item(item_id, values=self._pair_row_values(self.folder_pairs[pair_index]))
             self.status_label.config(text="Параметры сохранены")
             dialog.destroy()
         
@@ -615,150 +2527,891 @@ class FileRenamerApp:
             messagebox.showerror("Ошибка", "Добавьте хотя бы одну пару папок для обработки!")
             return
         
+        # Full processing recreates destinations, so watching is stopped / Полная обработка пересоздает папки назначения, поэтому слежение останавливается
+        self.stop_watching()
+        
         # Launch in separate thread / Запуск в отдельном потоке
         self.start_button.config(state='disabled')
-        # Count files in advance / Подсчет файлов заранее
-        total_files = 0
-        pair_file_counts = []
-        for pair in self.folder_pairs:
-            src = Path(pair['source'])
-            count = self.count_files_in_dir(src) if src.exists() else 0
-            pair_file_counts.append(count)
-            total_files += count
-
-        self.total_files = total_files
+        self.retry_button.config(state='disabled')
+        self.watch_button.config(state='disabled')
+        # Files are counted by processing thread, so window does not freeze on large trees / Файлы подсчитывает поток обработки, чтобы окно не зависало на больших деревьях
+        self.total_files = 0
+        self.pair_file_counts = [0] * len(self.folder_pairs)
         self.processed_files = 0
-        self.pair_file_counts = pair_file_counts
         self.current_pair_index = -1
+        self.start_job_metrics(range(len(self.folder_pairs)))
+        self.total_failures = 0
+        self.unsaved_failure_lists = []
+        self.verify_enabled = self.verify_var.get()
+        try:
+            self.shard_workers = max(0, self.shard_workers_var.get())
+        except tk.TclError:
+            self.shard_workers = 0
+        self.shard_manifest_dir = self.shard_manifest_var.get().strip()
 
         # Configure progress bars / Настройка прогресс-баров
-        self.progress.config(maximum=max(1, self.total_files))
+        self.progress.config(maximum=1)
         self.progress['value'] = 0
         self.progress_pair.config(maximum=1)
         self.progress_pair['value'] = 0
-        self.status_label.config(text="Обработка...")
-        self.progress_text.config(text=f"0 / {self.total_files} файлов (0%)")
+        self.status_label.config(text="Подсчет файлов...")
+        self.progress_text.config(text="")
         
         thread = threading.Thread(target=self.rename_files)
         thread.daemon = True
         thread.start()
     
+    def count_pair_files(self):
+        """
+        Count files of all pairs for progress, overlapping sources are walked once.
+        Подсчитать файлы всех пар для прогресса, пересекающиеся источники обходятся один раз.
+        """
+        counts = [0] * len(self.folder_pairs)
+        for group in group_overlapping_pairs(self.folder_pairs):
+            src = self.folder_pairs[group[0]]['source']
+            if not os.path.isdir(src):
+                continue
+            real_src = os.path.realpath(src)
+            totals = count_tree_files(src, [
+                os.path.relpath(os.path.realpath(self.folder_pairs[i]['source']), real_src) for i in group[1:]])
+            for i, total in zip(group, totals):
+                counts[i] = total
+        self.pair_file_counts = counts
+        self.total_files = sum(counts)
+
+    def scan_group_plans(self, group, group_failures):
+        """
+        Scan plans of pair group right before processing (first pair has outermost source).
+        Returns {pair index: (plan, indices)}; pairs that could not be scanned get 'scan' failure.
+        Сканировать планы группы пар непосредственно перед обработкой (у первой пары внешний источник).
+        Возвращает {индекс пары: (план, индексы)}; пары, которые не удалось просканировать, получают ошибку 'scan'.
+        """
+        src = Path(self.folder_pairs[group[0]]['source'])
+        scan_failures = []
+        try:
+            plan = RenamePlan.scan(src, scan_failures)
+        except OSError as e:
+            for i in group:
+                group_failures[i].append(failure_record('scan', None, e))
+            return {}
+        plans = {group[0]: (plan, None)}
+        group_failures[group[0]].extend(scan_failures)
+        for i in group[1:]:
+            member_source = self.folder_pairs[i]['source']
+            try:
+                plans[i] = self.member_plan(plan, src, member_source)
+            except OSError as e:
+                group_failures[i].append(failure_record('scan', None, e))
+                continue
+            # Unreadable entries inside member source, with paths relative to it / Нечитаемые элементы внутри источника участника, с путями относительно него
+            relative = os.path.relpath(os.path.realpath(member_source), os.path.realpath(src))
+            for failure in scan_failures:
+                if relative == os.curdir:
+                    group_failures[i].append(dict(failure))
+                elif failure['path'] == relative:
+                    group_failures[i].append(dict(failure, path=None))
+                elif _path_within(failure['path'], relative):
+                    group_failures[i].append(dict(failure, path=os.path.relpath(failure['path'], relative)))
+        return plans
+
     def rename_files(self):
         """
         Rename files in all folder pairs (runs in separate thread).
         Переименовать файлы во всех парах папок (выполняется в отдельном потоке).
         """
         try:
+            # Destinations are recreated, so stopped watchers must not write into them / Папки назначения пересоздаются, поэтому остановленные наблюдатели не должны в них писать
+            self.wait_stopped_watchers()
+            self.count_pair_files()
+            self.root.after(0, self.show_total_files)
             total_renamed = 0
             processed_pairs = 0
+            manifest_dir = self.start_shard_workers() if self.shard_workers else None
+            self.verifier = CopyVerifier() if self.verify_enabled else None
+            verified_pairs = []
+            
+            # Higher priority pairs first, list order within priority / Сначала пары с высоким приоритетом, внутри приоритета - по порядку списка
+            priority_order = list(PRIORITY_LEVELS)
+            pair_order = sorted(
+                range(len(self.folder_pairs)),
+                key=lambda index: priority_order.index(self.folder_pairs[index].get('priority', PRIORITY_NORMAL))
+            )
+            
+            if manifest_dir is None:
+                # Pairs with identical or nested sources share one read of source / Пары с одинаковыми или вложенными источниками читают источник один раз
+                groups = group_overlapping_pairs(self.folder_pairs, pair_order)
+            else:
+                groups = [[i] for i in pair_order]
             
-            for i, pair in enumerate(self.folder_pairs):
+            position = 0
+            for group in groups:
+                names = ", ".join(Path(self.folder_pairs[i]['source']).name for i in group)
+                
+                # Update status / Обновляем статус
+                if len(group) == 1:
+                    status = f"Обработка папки {position+1} из {len(self.folder_pairs)}: {names}"
+                else:
+                    status = f"Обработка папок {position+1}-{position+len(group)} из {len(self.folder_pairs)} (общее чтение): {names}"
+                self.root.after(0, self.update_status, status)
+                position += len(group)
+                self.current_pair_index = group[0]
+                
+                # Failed files do not stop the pair, they are saved for retry / Неудачные файлы не останавливают пару, они сохраняются для повтора
+                group_failures = {i: [] for i in group}
+                self.pair_failures_live = group_failures
+                self.pair_states.update(dict.fromkeys(group, 'running'))
+                # Source is scanned right before its pair, so files written by earlier pairs are seen
+                # Источник сканируется непосредственно перед парой, поэтому файлы, записанные предыдущими парами, учитываются
+                plans = self.scan_group_plans(group, group_failures)
+                for i, (plan, indices) in plans.items():
+                    self.pair_file_counts[i] = len(plan)
+                self.total_files = sum(self.pair_file_counts)
+                self.root.after(0, self.show_total_files)
+                self.root.after(0, self.reset_pair_progress, max(1, sum(self.pair_file_counts[i] for i in group)))
+                # Pairs that could not be scanned are not processed / Пары, которые не удалось просканировать, не обрабатываются
+                active = [i for i in group if i in plans]
                 try:
-                    source_path = Path(pair['source'])
-                    dest_path = Path(pair['destination'])
-                    
-                    # Update status / Обновляем статус
-                    self.root.after(0, self.update_status, f"Обработка папки {i+1} из {len(self.folder_pairs)}: {source_path.name}")
-                    self.current_pair_index = i
-                    pair_total = self.pair_file_counts[i] if i < len(self.pair_file_counts) else 0
-                    self.root.after(0, self.reset_pair_progress, max(1, pair_total))
-                    
-                    # Remove destination folder if exists / Удаляем папку назначения если существует
-                    if dest_path.exists():
-                        shutil.rmtree(dest_path)
-                    
-                    # Copy entire folder structure / Копируем всю структуру папок
-                    if source_path.exists():
-                        shutil.copytree(source_path, dest_path)
-                    
-                    # Rename files / Переименовываем файлы
-                    renamed_count = self.rename_files_recursive(
-                        dest_path, dest_path,
-                        separator=self.separator_var.get(),
-                        quote=self.quote_var.get(),
-                        include_root=self.include_root_var.get(),
-                        root_name=source_path.name,
-                        on_file_processed=lambda rel: self.root.after(0, self.increment_progress, rel)
-                    )
-                    total_renamed += renamed_count
-                    processed_pairs += 1
-                    
-                    # Update progress / Обновляем прогресс
-                    # Finish pair progress / Завершение прогресса пары
-                    self.root.after(0, self.finish_pair_progress)
-                    
+                    if len(active) == 1:
+                        i = active[0]
+                        total_renamed += self.process_pair(self.folder_pairs[i], plans[i][0], group_failures[i], manifest_dir, pair_index=i)
+                    elif active:
+                        total_renamed += self.process_pair_group(active, group_failures, plans)
                 except Exception as e:
-                    print(f"Ошибка при обработке пары {pair['source']} -> {pair['destination']}: {e}")
-                    continue
+                    # Whole pair failed, e.g. source is unavailable / Ошибка всей пары, например источник недоступен
+                    for i in active:
+                        group_failures[i].append(failure_record('pair', None, e))
+                for i in group:
+                    pair = self.folder_pairs[i]
+                    failures = group_failures[i]
+                    # Failure without path means whole pair failed / Ошибка без пути означает ошибку всей пары
+                    if not any(failure['path'] is None for failure in failures):
+                        processed_pairs += 1
+                        self.pair_states[i] = 'done'
+                    else:
+                        self.pair_states[i] = 'failed'
+                    self.save_pair_failures(pair, failures)
+                    self.total_failures += len(failures)
+                    verified_pairs.append((i, pair, failures))
+                
+                # Finish pair progress / Завершение прогресса пары
+                self.root.after(0, self.finish_pair_progress)
             
+            if self.verifier is not None:
+                self.root.after(0, self.update_status, "Завершение проверки копий...")
+                self.finish_verification(verified_pairs)
+            self.stop_shard_workers()
             # Update UI in main thread / Обновляем UI в главном потоке
             self.root.after(0, self.rename_complete, total_renamed, processed_pairs)
             
         except Exception as e:
+            self.stop_shard_workers()
+            if self.verifier is not None:
+                self.verifier.close()
+                self.verifier = None
             self.root.after(0, self.rename_error, str(e))
-    
-    def rename_files_recursive(self, current_path, root_path, total_renamed=0, separator=" + ", quote='"', include_root=False, root_name=None, on_file_processed=None):
+
+    def process_pair(self, pair, plan, failures, manifest_dir=None, pair_index=0):
         """
-        Recursively rename files in directory tree.
-        Рекурсивно переименовывает файлы в дереве директорий.
+        Recreate destination of one pair: copy, rename and apply folder metadata.
+        Failed files are added to failures list, exception means whole pair failed.
+        Пересоздать папку назначения одной пары: копирование, переименование и метаданные папок.
+        Неудачные файлы добавляются в список failures, исключение означает ошибку всей пары.
         """
-        files_in_this_dir = 0
-        safe_quote = self._effective_quote(quote or '')
-        safe_separator = self._effective_separator(separator or '')
+        source_path = Path(pair['source'])
+        dest_path = Path(pair['destination'])
+        set_io_priority(pair.get('priority', PRIORITY_NORMAL))
+        
+        # Remove destination folder if exists / Удаляем папку назначения если существует
+        if dest_path.exists():
+            rmtree_with_retry(dest_path)
+        
+        metadata_level = pair.get('metadata', METADATA_FULL)
+        if plan is None:
+            plan = RenamePlan.scan(source_path, failures)
+        if manifest_dir is not None:
+            # Copy and rename by worker processes / Копирование и переименование рабочими процессами
+            renamed_count = self.rename_pair_sharded(pair_index, pair, plan, manifest_dir, failures)
+            if self.verifier is not None:
+                self.submit_plan_verification(pair_index, pair, plan, failures)
+        else:
+            # Copy entire folder structure, copies are checked while copying goes on / Копируем всю структуру папок, копии проверяются, пока копирование продолжается
+            self.copy_tree(source_path, dest_path, metadata_level, plan=plan, failures=failures,
+                           on_file_copied=self._copy_verification_callback(pair_index, pair, plan))
+            
+            # Rename files / Переименовываем файлы
+            renamed_count = self.rename_files_from_plan(
+                plan, dest_path,
+                separator=self.separator_var.get(),
+                quote=self.quote_var.get(),
+                include_root=self.include_root_var.get(),
+                root_name=source_path.name,
+                on_file_processed=lambda rel: self.root.after(0, self.increment_progress, rel),
+                failures=failures,
+                before_rename=self.verifier.wait_released if self.verifier is not None else None
+            )
+        
+        # Directory metadata is applied after renaming, because renames change directory times
+        # Метаданные папок применяются после переименования, так как оно меняет даты папок
+        self.apply_directory_metadata(plan, source_path, dest_path, metadata_level, failures)
+        return renamed_count
+
+    def process_pair_group(self, group, group_failures, plans):
+        """
+        Recreate destinations of pairs with identical or nested sources (first pair has outermost source).
+        plans maps pair index to (plan, indices) from scan_group_plans, so source tree is scanned once;
+        every file is read once for all destinations, names are built per pair.
+        Пересоздать папки назначения пар с одинаковыми или вложенными источниками (у первой пары внешний источник).
+        plans сопоставляет индексу пары (план, индексы) из scan_group_plans, поэтому дерево источника сканируется один раз;
+        каждый файл читается один раз для всех назначений, имена строятся для каждой пары.
+        """
+        source_path = Path(self.folder_pairs[group[0]]['source'])
+        plan = plans[group[0]][0]
+        # Shared reading runs with highest priority of group / Общее чтение выполняется с наивысшим приоритетом группы
+        priority_order = list(PRIORITY_LEVELS)
+        set_io_priority(min(
+            (self.folder_pairs[i].get('priority', PRIORITY_NORMAL) for i in group), key=priority_order.index))
+        
+        members = []
+        for i in group:
+            pair = self.folder_pairs[i]
+            dest_path = Path(pair['destination'])
+            member_plan, indices = plans[i]
+            try:
+                # Remove destination folder if exists / Удаляем папку назначения если существует
+                if dest_path.exists():
+                    rmtree_with_retry(dest_path)
+            except OSError as e:
+                group_failures[i].append(failure_record('pair', None, e))
+                continue
+            members.append({
+                'index': i,
+                'pair': pair,
+                'plan': member_plan,
+                'indices': indices,
+                'dest_path': dest_path,
+                'metadata': pair.get('metadata', METADATA_FULL),
+                'failures': group_failures[i],
+                'on_file_copied': self._copy_verification_callback(i, pair, member_plan),
+            })
+        
+        self.copy_tree_fanout(source_path, plan, members)
+        
+        renamed_count = 0
+        for member in members:
+            pair = member['pair']
+            member_source = Path(pair['source'])
+            renamed_count += self.rename_files_from_plan(
+                member['plan'], member['dest_path'],
+                separator=self.separator_var.get(),
+                quote=self.quote_var.get(),
+                include_root=self.include_root_var.get(),
+                root_name=member_source.name,
+                on_file_processed=lambda rel: self.root.after(0, self.increment_progress, rel),
+                failures=member['failures'],
+                before_rename=self.verifier.wait_released if self.verifier is not None else None
+            )
+            self.apply_directory_metadata(member['plan'], member_source, member['dest_path'], member['metadata'], member['failures'])
+        return renamed_count
+
+    def _verification_callback(self, pair_index, pair):
+        """
+        Callback submitting placed file for verification (None when verification is off).
+        copied_path is file to read when file is not in its final place yet.
+        Функция, отправляющая размещенный файл на проверку (None, если проверка выключена).
+        copied_path - файл для чтения, если файл еще не на итоговом месте.
+        """
+        if self.verifier is None:
+            return None
+        source_path = Path(pair['source'])
+        dest_path = Path(pair['destination'])
+        self.verifier.open_manifest(pair_index, checksum_manifest_path(dest_path), {
+            'source': pair['source'],
+            'destination': pair['destination'],
+            'algorithm': 'sha256',
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        })
+        return lambda rel, target, copied_path=None: self.verifier.submit(
+            pair_index, source_path / rel, copied_path or target, rel, os.path.relpath(target, dest_path))
+
+    def _copy_verification_callback(self, pair_index, pair, plan):
+        """
+        Callback submitting copied file for verification as soon as it is copied (None when verification is off).
+        Manifest lists file under its final name; renaming of file waits until its check is done.
+        Функция, отправляющая файл на проверку сразу после копирования (None, если проверка выключена).
+        В манифесте файл записывается под итоговым именем; переименование файла ждет окончания его проверки.
+        """
+        on_file_placed = self._verification_callback(pair_index, pair)
+        if on_file_placed is None:
+            return None
+        # Files are copied in plan order, so names are taken from one pass of plan_targets
+        # Файлы копируются в порядке плана, поэтому имена берутся за один проход plan_targets
+        targets = self.plan_targets(
+            plan, self.separator_var.get(), self.quote_var.get(),
+            self.include_root_var.get(), Path(pair['source']).name)
+        def on_file_copied(index, copied_path):
+            for target_index, new_name in targets:
+                if target_index == index:
+                    break
+            on_file_placed(plan.relative_path(index), os.path.join(os.path.dirname(copied_path), new_name), copied_path)
+        return on_file_copied
+
+    def submit_plan_verification(self, pair_index, pair, plan, failures):
+        """
+        Submit all placed files of plan for verification (used after sharded processing).
+        Отправить на проверку все размещенные файлы плана (используется после обработки частями).
+        """
+        on_file_placed = self._verification_callback(pair_index, pair)
+        failed_paths = {failure['path'] for failure in failures}
+        dir_paths = plan.dir_paths(pair['destination'])
+        for index, new_name in self.plan_targets(
+                plan, self.separator_var.get(), self.quote_var.get(),
+                self.include_root_var.get(), Path(pair['source']).name):
+            relative_path = plan.relative_path(index)
+            if relative_path not in failed_paths:
+                on_file_placed(relative_path, os.path.join(dir_paths[plan.file_dir[index]], new_name))
+
+    def finish_verification(self, verified_pairs):
+        """
+        Wait for verification, write signed checksum manifests and add mismatches to failures.
+        Дождаться проверки, записать подписанные манифесты и добавить несовпадения в ошибки.
+        """
+        for pair_index, pair, failures in verified_pairs:
+            try:
+                result = self.verifier.finish(pair_index)
+            except OSError as e:
+                new_failures = [failure_record('manifest', None, e)]
+            else:
+                if result is None:
+                    continue
+                verified, mismatched = result
+                new_failures = [failure_record('verify', record['path'], record['error']) for record in mismatched]
+            if new_failures:
+                failures.extend(new_failures)
+                self.save_pair_failures(pair, failures)
+                self.total_failures += len(new_failures)
+        self.verifier.close()
+        self.verifier = None
+
+    def save_pair_failures(self, pair, failures):
+        """
+        Save failure list of pair for retry (file is removed when there are no failures).
+        Сохранить список ошибок пары для повтора (файл удаляется, если ошибок нет).
+        """
+        path = failures_path(pair['destination'])
+        try:
+            if failures:
+                _write_json_atomic(path, {'source': pair['source'], 'destination': pair['destination'], 'failures': failures})
+            else:
+                path.unlink(missing_ok=True)
+        except OSError as e:
+            # Reported when job completes / Сообщается по завершении задания
+            self.unsaved_failure_lists.append(f"{path}: {e}")
+
+    def add_pair_failures(self, pair, new_failures):
+        """
+        Add failures to saved failure list of pair (used by watch mode).
+        Добавить ошибки в сохраненный список ошибок пары (используется режимом слежения).
+        """
+        try:
+            with open(failures_path(pair['destination']), encoding='utf-8') as f:
+                failures = json.load(f)['failures']
+        except (OSError, ValueError, KeyError):
+            failures = []
+        # Same file failing again replaces old record / Повторная ошибка того же файла заменяет старую запись
+        paths = {failure['path'] for failure in new_failures}
+        failures = [failure for failure in failures if failure['path'] not in paths] + new_failures
+        self.save_pair_failures(pair, failures)
+
+    def start_retry_failures(self):
+        """
+        Start retrying only failed files from previous run.
+        Запустить повтор только неудачных файлов предыдущего запуска.
+        """
+        pair_failures = []
+        for pair in self.folder_pairs:
+            try:
+                with open(failures_path(pair['destination']), encoding='utf-8') as f:
+                    pair_failures.append((pair, json.load(f)['failures']))
+            except (OSError, ValueError, KeyError):
+                continue
+        if not pair_failures:
+            messagebox.showinfo("Информация", "Нет сохраненных ошибок для повтора!")
+            return
         
-        for item in current_path.iterdir():
-            if item.is_file():
-                files_in_this_dir += 1
-                # Get relative path from root folder / Получаем относительный путь от корневой папки
-                relative_path = item.relative_to(root_path)
-                
-                # Create new filename from folder names / Создаем новое имя файла из названий папок
-                folder_names = [part for part in relative_path.parts[:-1]]  # All parts except filename / Все части кроме имени файла
-                if include_root and root_name:
-                    folder_names = [root_name] + folder_names
-                file_name = item.stem  # Filename without extension / Имя файла без расширения
-                file_extension = item.suffix  # File extension / Расширение файла
-                
-                # Combine folder names with user parameters / Объединяем названия папок с пользовательскими параметрами
-                components = []
-                if folder_names:
-                    components.extend([f"{safe_quote}{name}{safe_quote}" if safe_quote else name for name in folder_names])
-                components.append(file_name)
-
-                if safe_separator:
-                    base_name = safe_separator.join(components)
-                else:
-                    base_name = ''.join(components)
+        self.stop_watching()
+        self.start_button.config(state='disabled')
+        self.retry_button.config(state='disabled')
+        self.watch_button.config(state='disabled')
+        self.total_files = sum(len(failures) for pair, failures in pair_failures)
+        self.processed_files = 0
+        self.total_failures = 0
+        self.unsaved_failure_lists = []
+        self.start_job_metrics(self.folder_pairs.index(pair) for pair, failures in pair_failures)
+        self.progress.config(maximum=max(1, self.total_files))
+        self.progress['value'] = 0
+        self.progress_pair.config(maximum=1)
+        self.progress_pair['value'] = 0
+        self.status_label.config(text="Повтор неудачных файлов...")
+        self.progress_text.config(text=f"0 / {self.total_files} файлов (0%)")
+        
+        thread = threading.Thread(target=self.retry_failed_files, args=(pair_failures,))
+        thread.daemon = True
+        thread.start()
 
-                sanitized_base = self._sanitize_output_name(base_name)
-                new_name = f"{sanitized_base}{file_extension}"
-                
-                # Rename file / Переименовываем файл
-                new_path = item.parent / new_name
-                
-                if str(new_path) != str(item):  # Avoid renaming to same name / Избегаем переименования в то же имя
+    def retry_failed_files(self, pair_failures):
+        """
+        Retry failed files of pairs (runs in separate thread).
+        Повторить неудачные файлы пар (выполняется в отдельном потоке).
+        """
+        try:
+            self.wait_stopped_watchers()
+            total_renamed = 0
+            processed_pairs = 0
+            separator = self.separator_var.get()
+            quote = self.quote_var.get()
+            include_root = self.include_root_var.get()
+            
+            for pair, failures in pair_failures:
+                self.root.after(0, self.update_status, f"Повтор ошибок: {Path(pair['source']).name}")
+                self.root.after(0, self.reset_pair_progress, max(1, len(failures)))
+                remaining = []
+                pair_index = self.folder_pairs.index(pair)
+                self.pair_failures_live = {pair_index: remaining}
+                self.pair_states[pair_index] = 'running'
+                if any(failure['path'] is None for failure in failures):
+                    # Pair failed as a whole: process it again / Ошибка всей пары: обрабатываем ее заново
                     try:
-                        item.rename(new_path)
-                        total_renamed += 1
-                        if on_file_processed is not None:
-                            try:
-                                on_file_processed(str(relative_path))
-                            except Exception:
-                                pass
+                        total_renamed += self.process_pair(pair, None, remaining)
                     except Exception as e:
-                        print(f"Ошибка переименования {item} в {new_path}: {e}")
-                    
-            elif item.is_dir():
-                # Recursively process subfolders / Рекурсивно обрабатываем подпапки
-                total_renamed = self.rename_files_recursive(
-                    item, root_path, total_renamed,
-                    separator=safe_separator, quote=safe_quote,
-                    include_root=include_root, root_name=root_name,
-                    on_file_processed=on_file_processed
-                )
+                        remaining.append(failure_record('pair', None, e))
+                else:
+                    for failure in failures:
+                        try:
+                            if failure['stage'] == 'mkdir':
+                                retry_io(os.makedirs, Path(pair['destination']) / failure['path'], 0o777, True)
+                            elif failure['stage'] == 'dirmeta':
+                                retry_io(self.copy_directory_metadata,
+                                         Path(pair['source']) / failure['path'], Path(pair['destination']) / failure['path'],
+                                         pair.get('metadata', METADATA_FULL))
+                            else:
+                                total_renamed += self.retry_failed_path(pair, failure['path'], separator, quote, include_root)
+                            self.root.after(0, self.increment_progress, failure['path'])
+                        except OSError as e:
+                            remaining.append(failure_record(failure['stage'], failure['path'], e))
+                self.save_pair_failures(pair, remaining)
+                self.total_failures += len(remaining)
+                processed_pairs += 1
+                self.pair_states[pair_index] = 'failed' if any(failure['path'] is None for failure in remaining) else 'done'
+                self.root.after(0, self.finish_pair_progress)
+            
+            self.root.after(0, self.rename_complete, total_renamed, processed_pairs)
+            
+        except Exception as e:
+            self.root.after(0, self.rename_error, str(e))
+
+    def start_shard_workers(self):
+        """
+        Prepare manifest folder and start local worker processes.
+        Подготовить папку манифеста и запустить локальные рабочие процессы.
+        """
+        if self.shard_manifest_dir:
+            manifest_dir = Path(self.shard_manifest_dir)
+            self.shard_manifest_temp = False
+        else:
+            manifest_dir = Path(tempfile.mkdtemp(prefix="file_renamer_shards_"))
+            self.shard_manifest_temp = True
+        
+        # Clear previous job / Очищаем предыдущее задание
+        (manifest_dir / 'job.json').unlink(missing_ok=True)
+        for name in SHARD_SUBDIRS:
+            shutil.rmtree(manifest_dir / name, ignore_errors=True)
+            (manifest_dir / name).mkdir(parents=True)
+        self.shard_manifest_path = manifest_dir
+        self.shard_job_id = secrets.token_hex(8)
+        self.shard_progress_seen = 0
+        self.shard_bytes_seen = 0
+        _write_json_atomic(manifest_dir / 'limits.json', self.throttle.limits)
+        # Job marker is written last: waiting workers start when it appears / Маркер задания пишется последним: ожидающие процессы начинают, когда он появляется
+        _write_json_atomic(manifest_dir / 'job.json', {'id': self.shard_job_id})
+        
+        # Spawn does not inherit Tk state of this process / Spawn не наследует состояние Tk этого процесса
+        context = multiprocessing.get_context('spawn')
+        self.shard_processes = []
+        self.shard_local_ids = set()
+        for n in range(self.shard_workers):
+            worker_id = f"{socket.gethostname()}-{os.getpid()}-{n}"
+            process = context.Process(target=run_shard_worker, args=(str(manifest_dir), worker_id, self.shard_job_id), daemon=True)
+            process.start()
+            self.shard_processes.append(process)
+            self.shard_local_ids.add(worker_id)
+        return manifest_dir
+
+    def stop_shard_workers(self):
+        """
+        Mark job finished and wait for local worker processes.
+        Отметить задание завершенным и дождаться локальных рабочих процессов.
+        """
+        if not self.shard_processes:
+            return
+        manifest_dir = self.shard_manifest_path
+        _write_json_atomic(manifest_dir / 'FINISHED', {'id': self.shard_job_id})
+        for process in self.shard_processes:
+            process.join()
+        self.shard_processes = []
+        if self.shard_manifest_temp:
+            shutil.rmtree(manifest_dir, ignore_errors=True)
+
+    def rename_pair_sharded(self, pair_index, pair, plan, manifest_dir, failures):
+        """
+        Split pair plan into shards by folders and wait for workers to process them.
+        Разделить план пары на части по папкам и дождаться их обработки рабочими процессами.
+        """
+        source_path = Path(pair['source'])
+        dest_path = Path(pair['destination'])
+        # Folders are created here, so empty folders are copied too / Папки создаются здесь, чтобы копировались и пустые папки
+        self.make_plan_dirs(plan, dest_path, failures)
+        
+        prefix = f"p{pair_index:04d}-"
+        shard_count = 0
+        for folders in plan.shards():
+            shard = {
+                'source': str(source_path),
+                'destination': str(dest_path),
+                'metadata': pair.get('metadata', METADATA_FULL),
+                'priority': pair.get('priority', PRIORITY_NORMAL),
+                'separator': self.separator_var.get(),
+                'quote': self.quote_var.get(),
+                'include_root': self.include_root_var.get(),
+                'root_name': source_path.name,
+                'folders': folders,
+            }
+            _write_json_atomic(manifest_dir / 'shards' / f"{prefix}{shard_count:06d}.json", shard)
+            shard_count += 1
         
-        return total_renamed
+        while True:
+            self.collect_shard_progress(manifest_dir)
+            done = [name for name in os.listdir(manifest_dir / 'done') if name.startswith(prefix) and name.endswith('.json')]
+            if len(done) >= shard_count:
+                break
+            # Claims of workers without heartbeat (local or remote) go back to queue / Захваты процессов без пульса (локальных или удаленных) возвращаются в очередь
+            self.requeue_stale_shards(manifest_dir)
+            if not any(process.is_alive() for process in self.shard_processes):
+                # Local workers exited: requeue their shards and process them here / Локальные процессы завершились: возвращаем их части и обрабатываем здесь
+                self.requeue_stale_shards(manifest_dir, self.shard_local_ids)
+                claimed = _claim_next_shard(manifest_dir, 'coordinator', prefix)
+                if claimed is not None:
+                    result = _process_claimed_shard(
+                        self, manifest_dir, *claimed,
+                        on_file_processed=lambda rel: self.root.after(0, self.increment_progress, rel)
+                    )
+                    _finish_shard(manifest_dir, claimed[0], claimed[1], result)
+                    continue
+            time.sleep(SHARD_POLL_INTERVAL)
+        
+        renamed_count = 0
+        for name in done:
+            with open(manifest_dir / 'done' / name, encoding='utf-8') as f:
+                result = json.load(f)
+            renamed_count += result['renamed']
+            failures.extend(result['failures'])
+        return renamed_count
+
+    def collect_shard_progress(self, manifest_dir):
+        """
+        Sum progress reported by workers and forward new files to progress bars.
+        Суммировать прогресс рабочих процессов и передать новые файлы в прогресс-бары.
+        """
+        total = 0
+        total_bytes = 0
+        for name in os.listdir(manifest_dir / 'progress'):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(manifest_dir / 'progress' / name, encoding='utf-8') as f:
+                    progress = json.load(f)
+                total += progress['renamed']
+                total_bytes += progress.get('bytes', 0)
+            except (OSError, ValueError, KeyError):
+                continue
+        if total_bytes > self.shard_bytes_seen:
+            self.bytes_copied += total_bytes - self.shard_bytes_seen
+            self.shard_bytes_seen = total_bytes
+        delta = total - self.shard_progress_seen
+        if delta > 0:
+            self.shard_progress_seen = total
+            self.root.after(0, self.increment_progress, "рабочие процессы", delta)
+
+    def requeue_stale_shards(self, manifest_dir, owners=()):
+        """
+        Return shards claimed by workers with expired lease (or by given owners) back to queue.
+        Вернуть в очередь части, захваченные процессами с истекшей арендой (или указанными владельцами).
+        """
+        live = _live_workers(manifest_dir)
+        for name in os.listdir(manifest_dir / 'claimed'):
+            if not name.endswith('.json'):
+                continue
+            shard_id, _, owner = name[:-len('.json')].partition('@')
+            # Coordinator processes its claims synchronously / Координатор обрабатывает свои захваты синхронно
+            if owner == 'coordinator':
+                continue
+            if owner not in live or owner in owners:
+                try:
+                    os.rename(manifest_dir / 'claimed' / name, manifest_dir / 'shards' / f"{shard_id}.json")
+                except FileNotFoundError:
+                    continue
     
+    def apply_limits(self):
+        """
+        Apply throughput limits from input fields (also to running job).
+        Применить ограничения скорости из полей ввода (в том числе к идущей обработке).
+        """
+        try:
+            mb_per_sec = float(self.max_mbps_var.get().replace(',', '.') or 0)
+            files_per_sec = float(self.max_files_var.get().replace(',', '.') or 0)
+        except ValueError:
+            messagebox.showerror("Ошибка", "Лимиты должны быть числами (0 — без ограничения)!")
+            return
+        self.set_limits(mb_per_sec, files_per_sec)
+        self.status_label.config(text="Ограничения скорости применены")
+
+    def set_limits(self, mb_per_sec, files_per_sec):
+        """
+        Set throughput limits for local copying and worker processes.
+        Установить ограничения скорости для локального копирования и рабочих процессов.
+        """
+        self.throttle.set_limits(mb_per_sec, files_per_sec)
+        self.max_mbps_var.set(f"{self.throttle.mb_per_sec:g}")
+        self.max_files_var.set(f"{self.throttle.files_per_sec:g}")
+        if self.shard_processes:
+            _write_json_atomic(self.shard_manifest_path / 'limits.json', self.throttle.limits)
+
+    def _limits_control_mtime(self):
+        try:
+            return LIMITS_CONTROL_FILE.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def poll_limits_control(self):
+        """
+        Apply limits written by --set-limits command after start (checked every second).
+        Применить ограничения, записанные командой --set-limits после запуска (проверка раз в секунду).
+        """
+        mtime = self._limits_control_mtime()
+        if mtime is not None and mtime != self.limits_control_mtime:
+            # Limit not given to --set-limits keeps its current value / Ограничение, не указанное в --set-limits, сохраняет текущее значение
+            limits = read_limits_file(LIMITS_CONTROL_FILE, self.throttle.limits)
+            if limits is not None:
+                self.set_limits(*limits)
+        self.limits_control_mtime = mtime
+        self.root.after(1000, self.poll_limits_control)
+
+    def apply_metrics(self):
+        """
+        Start, restart or stop metrics endpoint with values from settings.
+        Запустить, перезапустить или остановить метрики с параметрами из настроек.
+        """
+        try:
+            port = int(self.metrics_port_var.get() or 0)
+            if not 0 <= port <= 65535:
+                raise ValueError(port)
+        except ValueError:
+            messagebox.showerror("Ошибка", "Порт метрик должен быть числом от 0 до 65535!")
+            return
+        textfile = self.metrics_textfile_var.get().strip()
+        if self.metrics is not None:
+            self.metrics.close()
+            self.metrics = None
+        if not port and not textfile:
+            self.status_label.config(text="Метрики выключены")
+            return
+        try:
+            self.metrics = MetricsExporter(self.collect_metrics, port=port, textfile=textfile or None)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось запустить метрики:\n{e}")
+            return
+        targets = []
+        if port:
+            targets.append(f"http://{METRICS_HOST}:{port}/metrics")
+        if textfile:
+            targets.append(textfile)
+        self.status_label.config(text="Метрики: " + ", ".join(targets))
+
+    def start_job_metrics(self, pair_indices):
+        """
+        Reset metrics state for new job of given pairs.
+        Сбросить состояние метрик для нового задания указанных пар.
+        """
+        with self.metrics_lock:
+            self.metrics_samples.clear()
+        self.bytes_copied = 0
+        self.job_started = time.time()
+        self.pair_failures_live = {}
+        self.pair_states = dict.fromkeys(pair_indices, 'pending')
+        self.job_running = True
+
+    def collect_metrics(self):
+        """
+        Metric families of current job (called from metrics threads).
+        Values come from the same counters as progress bars.
+        Семейства метрик текущего задания (вызывается из потоков метрик).
+        Значения берутся из тех же счетчиков, что и прогресс-бары.
+        """
+        processed = self.processed_files
+        bytes_copied = self.bytes_copied
+        now = time.monotonic()
+        # Throughput over sliding window / Скорость в скользящем окне
+        with self.metrics_lock:
+            samples = self.metrics_samples
+            if samples and (processed < samples[-1][1] or bytes_copied < samples[-1][2]):
+                samples.clear()
+            samples.append((now, processed, bytes_copied))
+            while len(samples) > 2 and now - samples[1][0] >= METRICS_RATE_WINDOW:
+                samples.popleft()
+            first = samples[0]
+        elapsed = now - first[0]
+        files_rate = (processed - first[1]) / elapsed if elapsed > 0 else 0.0
+        bytes_rate = (bytes_copied - first[2]) / elapsed if elapsed > 0 else 0.0
+        
+        queue_depth = []
+        utilization = []
+        verifier = self.verifier
+        if verifier is not None:
+            queued = verifier.queued
+            queue_depth.append(({'queue': 'verify'}, queued))
+            utilization.append(({'pool': 'verify'}, min(queued, verifier.workers) / verifier.workers))
+        manifest_dir = getattr(self, 'shard_manifest_path', None)
+        if self.shard_processes and manifest_dir is not None:
+            try:
+                waiting = sum(1 for name in os.listdir(manifest_dir / 'shards') if name.endswith('.json'))
+                claimed = sum(1 for name in os.listdir(manifest_dir / 'claimed') if name.endswith('.json'))
+                workers = len(_live_workers(manifest_dir))
+                queue_depth.append(({'queue': 'shards'}, waiting))
+                utilization.append(({'pool': 'shards'}, min(claimed, workers) / workers if workers else 0.0))
+            except OSError:
+                pass
+        
+        pair_states = []
+        pair_files = []
+        pair_errors = []
+        for index, state in sorted(self.pair_states.items()):
+            if index >= len(self.folder_pairs):
+                continue
+            pair = self.folder_pairs[index]
+            labels = {'pair': index, 'source': pair['source'], 'destination': pair['destination']}
+            for name in PAIR_STATES:
+                pair_states.append(({**labels, 'state': name}, int(name == state)))
+            if index < len(getattr(self, 'pair_file_counts', [])):
+                pair_files.append((labels, self.pair_file_counts[index]))
+            failures = self.pair_failures_live.get(index)
+            if failures is not None:
+                pair_errors.append((labels, len(failures)))
+        
+        return [
+            ('file_renamer_job_running', 'gauge', "1 while processing runs", [({}, int(self.job_running))]),
+            ('file_renamer_job_start_time_seconds', 'gauge', "Start time of last job (unix time)", [({}, self.job_started)]),
+            ('file_renamer_files_total', 'gauge', "Files to process in current job", [({}, self.total_files)]),
+            ('file_renamer_files_processed_total', 'counter', "Files processed in current job", [({}, processed)]),
+            ('file_renamer_bytes_copied_total', 'counter', "Bytes copied in current job", [({}, bytes_copied)]),
+            ('file_renamer_files_per_second', 'gauge', f"Files processed per second over last {METRICS_RATE_WINDOW:g}s", [({}, round(files_rate, 3))]),
+            ('file_renamer_bytes_per_second', 'gauge', f"Bytes copied per second over last {METRICS_RATE_WINDOW:g}s", [({}, round(bytes_rate, 1))]),
+            ('file_renamer_errors_total', 'counter', "Failed files of finished pairs in current job", [({}, self.total_failures)]),
+            ('file_renamer_queue_depth', 'gauge', "Items waiting in queue", queue_depth),
+            ('file_renamer_worker_utilization', 'gauge', "Busy share of worker pool (0-1)", utilization),
+            ('file_renamer_pair_state', 'gauge', "Current state of folder pair", pair_states),
+            ('file_renamer_pair_files', 'gauge', "Files to process in folder pair", pair_files),
+            ('file_renamer_pair_errors', 'gauge', "Failed files of folder pair so far", pair_errors),
+        ]
+
+    def toggle_watching(self):
+        """
+        Start or stop watch mode.
+        Запустить или остановить режим слежения.
+        """
+        if self.watchers:
+            self.stop_watching()
+            self.status_label.config(text="Слежение остановлено")
+        else:
+            self.start_watching()
+
+    def start_watching(self):
+        """
+        Start watching source folders of all pairs.
+        Запустить слежение за исходными папками всех пар.
+        """
+        if not self.folder_pairs:
+            messagebox.showerror("Ошибка", "Добавьте хотя бы одну пару папок для обработки!")
+            return
+        if self.job_running:
+            # Processing recreates destinations / Обработка пересоздает папки назначения
+            messagebox.showerror("Ошибка", "Слежение нельзя запустить во время обработки!")
+            return
+        
+        # Naming settings are fixed at start / Настройки именования фиксируются при запуске
+        separator = self.separator_var.get()
+        quote = self.quote_var.get()
+        include_root = self.include_root_var.get()
+        for pair in self.folder_pairs:
+            if not Path(pair['source']).is_dir():
+                continue
+            watcher = FolderWatcher(pair['source'], None)
+            watcher.on_changes = lambda paths, pair=pair, stop_event=watcher.stop_event: self.mirror_changes(
+                pair, paths, separator, quote, include_root, stop_event)
+            # Watcher does not report after stop, so Tk is not touched / Наблюдатель не сообщает после остановки, поэтому Tk не используется
+            watcher.on_error = lambda message: self.root.after(0, self.update_status, message)
+            watcher.start()
+            self.watchers.append(watcher)
+        
+        self.watch_button.config(text="Остановить слежение")
+        self.status_label.config(text=f"Слежение за папками: {len(self.watchers)}")
+
+    def stop_watching(self):
+        """
+        Stop all watchers without waiting (Tk thread must not block on them).
+        Остановить всех наблюдателей без ожидания (поток Tk не должен их ждать).
+        """
+        for watcher in self.watchers:
+            watcher.stop()
+        self.stopping_watchers.extend(self.watchers)
+        self.watchers = []
+        self.watch_button.config(text="Следить за папками")
+
+    def wait_stopped_watchers(self):
+        """
+        Wait for stopped watchers to finish current file (called from processing thread).
+        Дождаться, пока остановленные наблюдатели закончат текущий файл (вызывается из потока обработки).
+        """
+        while self.stopping_watchers:
+            self.stopping_watchers.pop().join()
+
+    def mirror_changes(self, pair, relative_paths, separator=" + ", quote='"', include_root=False, stop_event=None):
+        """
+        Copy and rename changed files of pair (runs in watcher thread).
+        After stop_event is set nothing more is mirrored and Tk is not touched.
+        Скопировать и переименовать измененные файлы пары (выполняется в потоке наблюдателя).
+        После установки stop_event больше ничего не копируется и Tk не используется.
+        """
+        mirrored = 0
+        failures = []
+        for relative_path in relative_paths:
+            if stop_event is not None and stop_event.is_set():
+                break
+            try:
+                mirrored += self.mirror_path(pair, relative_path, separator, quote, include_root)
+            except OSError as e:
+                failures.append(failure_record('mirror', relative_path, e))
+        # Failed files can be redone with "Повторить ошибки" / Неудачные файлы можно повторить кнопкой "Повторить ошибки"
+        unsaved = len(self.unsaved_failure_lists)
+        if failures:
+            self.add_pair_failures(pair, failures)
+        if (mirrored or failures) and (stop_event is None or not stop_event.is_set()):
+            status = f"Синхронизировано файлов: {mirrored} — {Path(pair['source']).name}"
+            if failures:
+                status += f", ошибок: {len(failures)}"
+            if len(self.unsaved_failure_lists) > unsaved:
+                status += f" (список ошибок не сохранен: {self.unsaved_failure_lists[-1]})"
+            self.root.after(0, self.update_status, status)
+        return mirrored
+
     def update_status(self, message):
         """
         Update status in main thread.
@@ -788,16 +3441,25 @@ class FileRenamerApp:
         """
         self.progress_pair['value'] = self.progress_pair['maximum']
 
-    def increment_progress(self, relative_path):
+    def show_total_files(self):
+        """
+        Show total file count counted by processing thread.
+        Показать общее количество файлов, подсчитанное потоком обработки.
+        """
+        self.progress.config(maximum=max(1, self.total_files))
+        percent = 0 if self.total_files == 0 else int(self.processed_files * 100 / self.total_files)
+        self.progress_text.config(text=f"{self.processed_files} / {self.total_files} файлов ({percent}%)")
+
+    def increment_progress(self, relative_path, count=1):
         """
         Increment progress counters.
         Увеличить счетчики прогресса.
         """
         # Update total progress / Обновляем суммарный прогресс
-        self.processed_files = min(self.total_files, self.processed_files + 1)
+        self.processed_files = min(self.total_files, self.processed_files + count)
         self.progress['value'] = self.processed_files
         # Update current pair progress / Обновляем прогресс текущей пары
-        self.progress_pair['value'] = min(self.progress_pair['maximum'], self.progress_pair['value'] + 1)
+        self.progress_pair['value'] = min(self.progress_pair['maximum'], self.progress_pair['value'] + count)
         # Update text / Обновляем текст
         percent = 0 if self.total_files == 0 else int(self.processed_files * 100 / self.total_files)
         # Shorten path for display / Укорачиваем путь для отображения
@@ -806,19 +3468,6 @@ class FileRenamerApp:
             disp = '…' + disp[-59:]
         self.progress_text.config(text=f"{self.processed_files} / {self.total_files} файлов ({percent}%) — {disp}")
 
-    def count_files_in_dir(self, directory: Path) -> int:
-        """
-        Count total files in directory tree.
-        Подсчитать общее количество файлов в дереве директорий.
-        """
-        total = 0
-        try:
-            for root, dirs, files in os.walk(directory):
-                total += len(files)
-        except Exception:
-            pass
-        return total
-    
     def rename_complete(self, renamed_count, processed_pairs):
         """
         Handle completion of renaming process.
@@ -826,7 +3475,23 @@ class FileRenamerApp:
         """
         self.progress['value'] = self.total_files if hasattr(self, 'total_files') else len(self.folder_pairs)
         self.finish_pair_progress()
+        self.job_running = False
         self.start_button.config(state='normal')
+        self.retry_button.config(state='normal')
+        self.watch_button.config(state='normal')
+        failures = getattr(self, 'total_failures', 0)
+        unsaved = "\n".join(self.unsaved_failure_lists)
+        if failures or unsaved:
+            self.status_label.config(text=f"Готово с ошибками: {failures}")
+            self.progress_text.config(text=f"Переименовано файлов: {renamed_count}, ошибок: {failures}")
+            message = f"Не удалось обработать файлов: {failures}.\n" if failures else ""
+            if unsaved:
+                message += f"Не удалось сохранить список ошибок:\n{unsaved}"
+            else:
+                message += ("Список ошибок сохранен рядом с папками назначения (*.failures.json).\n"
+                            "Нажмите «Повторить ошибки», чтобы обработать только их.")
+            messagebox.showwarning("Предупреждение", message)
+            return
         self.status_label.config(text="Готово! Обработка завершена")
         self.progress_text.config(text=f"Переименовано файлов: {renamed_count}")
         messagebox.showinfo("Успех", "Успешно переименовано")
@@ -837,7 +3502,10 @@ class FileRenamerApp:
         Обработать ошибку во время процесса переименования.
         """
         self.progress['value'] = 0
+        self.job_running = False
         self.start_button.config(state='normal')
+        self.retry_button.config(state='normal')
+        self.watch_button.config(state='normal')
         self.status_label.config(text="Ошибка при обработке")
         messagebox.showerror("Ошибка", f"Произошла ошибка:\n{error_message}")
 
@@ -847,6 +3515,49 @@ def main():
     Main entry point of the application.
     Главная точка входа приложения.
     """
+    parser = argparse.ArgumentParser(description="Программа переименования файлов")
+    parser.add_argument('--worker', metavar='MANIFEST_DIR',
+                        help="run as worker process of sharded jobs until stopped / запуск рабочим процессом обработки частями до остановки")
+    parser.add_argument('--worker-id', help="worker name in manifest / имя рабочего процесса в манифесте")
+    parser.add_argument('--set-limits', action='store_true',
+                        help="change limits of running program and exit / изменить ограничения запущенной программы и выйти")
+    parser.add_argument('--max-mbps', type=float, default=None,
+                        help="copy limit in MB/s, 0 - no limit, not given - unchanged / лимит копирования в МБ/с, 0 - без ограничения, не указан - без изменений")
+    parser.add_argument('--max-files-per-sec', type=float, default=None,
+                        help="copy limit in files/s, 0 - no limit, not given - unchanged / лимит копирования в файлах/с, 0 - без ограничения, не указан - без изменений")
+    parser.add_argument('--verify-manifest', metavar='PATH',
+                        help="check signature of checksum manifest and exit / проверить подпись манифеста контрольных сумм и выйти")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help=f"serve Prometheus metrics on {METRICS_HOST}:PORT/metrics / отдавать метрики Prometheus на {METRICS_HOST}:PORT/metrics")
+    parser.add_argument('--metrics-textfile', default='',
+                        help="write Prometheus metrics to file / записывать метрики Prometheus в файл")
+    args = parser.parse_args()
+    if args.set_limits:
+        # Only given limits are written, the running program keeps the others / Записываются только указанные ограничения, запущенная программа сохраняет остальные
+        limits = {name: value for name, value in (('mb_per_sec', args.max_mbps), ('files_per_sec', args.max_files_per_sec))
+                  if value is not None}
+        if not limits:
+            parser.error("укажите --max-mbps и/или --max-files-per-sec")
+        _write_json_atomic(LIMITS_CONTROL_FILE, limits)
+        return
+    if args.worker:
+        try:
+            run_shard_worker(args.worker, args.worker_id)
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.verify_manifest:
+        try:
+            totals = check_manifest_signature(args.verify_manifest)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось прочитать манифест {args.verify_manifest}: {e}")
+            sys.exit(2)
+        if totals is None:
+            print(f"Подпись манифеста неверна: {args.verify_manifest}")
+            sys.exit(1)
+        print(f"Подпись манифеста верна: проверено {totals.get('verified')}, несовпадений {totals.get('mismatched')}")
+        sys.exit(1 if totals.get('mismatched') else 0)
+    
     root = tk.Tk()
     
     # Style setup / Настройка стиля
@@ -855,6 +3566,10 @@ def main():
     
     # Create application / Создание приложения
     app = FileRenamerApp(root)
+    if args.metrics_port or args.metrics_textfile:
+        app.metrics_port_var.set(str(args.metrics_port))
+        app.metrics_textfile_var.set(args.metrics_textfile)
+        app.apply_metrics()
     
     # Run main loop / Запуск главного цикла
     root.mainloop()